@@ -0,0 +1,169 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+#    Authors:
+#        Pavel Březina <pbrezina@redhat.com>
+#
+#    Copyright (C) 2019 Red Hat
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Compare the checksum engine used by 'box metadata' with the original
+64 KiB read loop that computes one digest per pass over the file.
+
+Run from the cli directory:
+
+    python3 -m benchmarks.checksum --size 1024 --digest sha256 sha512
+
+With --cold, the file is evicted from page cache before each pass over it,
+as if it did not fit into memory like most real boxes.
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import time
+
+from util.checksum import Checksum
+
+
+class ChecksumBenchmark:
+    def __init__(self, args):
+        self.args = args
+
+    def evict(self, path):
+        if not self.args.cold:
+            return
+
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fdatasync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+    def legacy(self, path):
+        checksums = {}
+        for algorithm in self.args.digests:
+            self.evict(path)
+            h = hashlib.new(algorithm)
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(65536), b''):
+                    h.update(block)
+
+            checksums[algorithm] = h.hexdigest()
+
+        return checksums
+
+    def engine(self, method):
+        checksum = Checksum(
+            self.args.digests, method, self.args.block_size * 1024 * 1024
+        )
+
+        def compute(path):
+            self.evict(path)
+            return checksum.compute(path)
+
+        return compute
+
+    def sample(self, tmpdir):
+        if self.args.file is not None:
+            return self.args.file
+
+        path = f'{tmpdir}/sample.img'
+        with open(path, 'wb') as f:
+            for _ in range(self.args.size):
+                f.write(os.urandom(1024 * 1024))
+
+        return path
+
+    def run(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = self.sample(tmpdir)
+            size = os.path.getsize(path)
+
+            benchmarks = [
+                ('legacy', self.legacy),
+                ('read', self.engine('read')),
+                ('mmap', self.engine('mmap')),
+            ]
+
+            print('File: {} ({:.1f} MiB), digests: {}'.format(
+                path, size / 1024 / 1024, ', '.join(self.args.digests)
+            ))
+
+            print('{:8s} {:>10s} {:>10s}'.format('method', 'wall [s]', 'MB/s'))
+
+            expected = None
+            for (name, function) in benchmarks:
+                timings = []
+                for _ in range(self.args.repeat):
+                    start = time.monotonic()
+                    checksums = function(path)
+                    timings.append(time.monotonic() - start)
+
+                if expected is None:
+                    expected = checksums
+                elif checksums != expected:
+                    raise RuntimeError(f'Method {name} computed different checksums')
+
+                duration = min(timings)
+                print('{:8s} {:10.3f} {:10.1f}'.format(
+                    name, duration, size / duration / 1e6
+                ), flush=True)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Checksum benchmark')
+
+    parser.add_argument(
+        '--size', type=int, default=512, metavar='MiB',
+        help='Size of generated sample file (Default 512)'
+    )
+
+    parser.add_argument(
+        '--file', type=str, default=None,
+        help='Use existing file (e.g. a real box) instead of a sample'
+    )
+
+    parser.add_argument(
+        '--digest', nargs='+', default=['sha256'], dest='digests',
+        choices=Checksum.Algorithms, help='Digests to compute (Default sha256)'
+    )
+
+    parser.add_argument(
+        '--block-size', type=int, default=8, dest='block_size', metavar='MiB',
+        help='Block size used by the engine (Default 8)'
+    )
+
+    parser.add_argument(
+        '--cold', action='store_true',
+        help='Evict the file from page cache before each pass over it'
+    )
+
+    parser.add_argument(
+        '--repeat', type=int, default=3,
+        help='Number of runs of each method, the best one is reported (Default 3)'
+    )
+
+    ChecksumBenchmark(parser.parse_args(argv)).run()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,190 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+#    Authors:
+#        Pavel Březina <pbrezina@redhat.com>
+#
+#    Copyright (C) 2019 Red Hat
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Measure 'cloud list', 'cloud prune' and 'cloud upload' against a local
+fake vagrant cloud server. No network access is required.
+
+Run from the cli directory:
+
+    python3 -m benchmarks.cloud --sizes 10 100 1000 --latency 0.005
+"""
+
+import argparse
+import contextlib
+import io
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import nutcli.runner
+import nutcli.shell
+
+from commands.cloud import CloudListActor, CloudPruneActor, CloudUploadActor
+from util.fakecloud import FakeVagrantCloud
+
+
+class CloudBenchmark:
+    def __init__(self, args):
+        self.args = args
+        self.logger = logging.getLogger('sssd-test-suite-benchmark')
+        self.logger.setLevel(logging.CRITICAL)
+
+    def actor(self, cls):
+        actor = cls()
+        actor._setup_root_actor(
+            cli_args=argparse.Namespace(config=None),
+            logger=self.logger,
+            shell=nutcli.shell.Shell()
+        )
+        actor.get_credentials = lambda username, token: ('sssd', 'benchmark')
+
+        return actor
+
+    @contextlib.contextmanager
+    def server(self, size):
+        cloud = FakeVagrantCloud(
+            latency=self.args.latency, page_limit=self.args.page_limit
+        )
+        cloud.populate(size, self.args.versions)
+
+        os.environ['SSSD_TEST_SUITE_CLOUD_URL'] = cloud.url
+        with cloud:
+            yield cloud
+
+    def measure(self, cloud, function):
+        requests = cloud.requests
+        start = time.monotonic()
+        with contextlib.redirect_stdout(io.StringIO()):
+            function()
+
+        return (time.monotonic() - start, cloud.requests - requests)
+
+    def bench_list(self, size):
+        with self.server(size) as cloud:
+            actor = self.actor(CloudListActor)
+            return self.measure(cloud, lambda: actor(
+                None, None, pool_size=self.args.jobs, cache_ttl=None
+            )) + (0,)
+
+    def bench_prune(self, size):
+        with self.server(size) as cloud:
+            actor = self.actor(CloudPruneActor)
+            return self.measure(cloud, lambda: actor(
+                None, None, keep=1, jobs=self.args.jobs, cache_ttl=None
+            )) + (0,)
+
+    def bench_upload(self, size):
+        box_size = self.args.box_size * 1024 * 1024
+        with self.server(size) as cloud, tempfile.TemporaryDirectory() as tmp:
+            boxes = []
+            for i in range(self.args.uploads):
+                path = f'{tmp}/sssd-benchmark-guest{i}-20200101.01.box'
+                with open(path, 'wb') as f:
+                    f.write(os.urandom(box_size))
+                boxes.append(path)
+
+            actor = self.actor(CloudUploadActor)
+            return self.measure(cloud, lambda: actor(
+                None, None, boxes, jobs=self.args.jobs, cache_ttl=None,
+                chunk_size=self.args.chunk_size, checksum_cache=False
+            )) + (box_size * len(boxes),)
+
+    def run(self):
+        benchmarks = [
+            ('list', self.bench_list),
+            ('prune', self.bench_prune),
+            ('upload', self.bench_upload),
+        ]
+
+        print('{:8s} {:>6s} {:>10s} {:>9s} {:>10s} {:>10s}'.format(
+            'command', 'boxes', 'wall [s]', 'requests', 'req/s', 'MB/s'
+        ))
+
+        for size in self.args.sizes:
+            for (name, benchmark) in benchmarks:
+                if name not in self.args.commands:
+                    continue
+
+                (duration, requests, uploaded) = benchmark(size)
+                print('{:8s} {:6d} {:10.3f} {:9d} {:10.1f} {:>10s}'.format(
+                    name, size, duration, requests, requests / duration,
+                    f'{uploaded / duration / 1e6:.1f}' if uploaded else '-'
+                ), flush=True)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Vagrant cloud benchmark')
+
+    parser.add_argument(
+        '--sizes', nargs='+', type=int, default=[10, 100, 1000],
+        help='Number of boxes in the catalog (Default 10 100 1000)'
+    )
+
+    parser.add_argument(
+        '--commands', nargs='+', default=['list', 'prune', 'upload'],
+        choices=['list', 'prune', 'upload'], help='Commands to measure'
+    )
+
+    parser.add_argument(
+        '--versions', type=int, default=3,
+        help='Number of versions of each box (Default 3)'
+    )
+
+    parser.add_argument(
+        '--latency', type=float, default=0.0,
+        help='Latency of each request in seconds (Default 0)'
+    )
+
+    parser.add_argument(
+        '--page-limit', type=int, default=100, dest='page_limit',
+        help='Maximum number of boxes per search page (Default 100)'
+    )
+
+    parser.add_argument(
+        '--jobs', type=int, default=8,
+        help='Number of parallel jobs and connections (Default 8)'
+    )
+
+    parser.add_argument(
+        '--uploads', type=int, default=4,
+        help='Number of boxes to upload (Default 4)'
+    )
+
+    parser.add_argument(
+        '--box-size', type=int, default=32, dest='box_size', metavar='MiB',
+        help='Size of uploaded boxes (Default 32)'
+    )
+
+    parser.add_argument(
+        '--chunk-size', type=int, default=0, dest='chunk_size', metavar='MiB',
+        help='Use chunked upload with given chunk size'
+    )
+
+    CloudBenchmark(parser.parse_args(argv)).run()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
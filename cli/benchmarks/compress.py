@@ -0,0 +1,162 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+#    Authors:
+#        Pavel Březina <pbrezina@redhat.com>
+#
+#    Copyright (C) 2019 Red Hat
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Compare qemu-img conversion settings used by 'box create' to compress
+guest images. Each combination of settings converts the same image and
+the wall time and size of the result are reported.
+
+Run from the cli directory:
+
+    python3 -m benchmarks.compress --image /path/to/pool/sssd-test-suite_client.img
+    python3 -m benchmarks.compress --size 2048 --coroutines 1 8 16 --compression none zstd
+"""
+
+import argparse
+import itertools
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from util.image import QcowConversion, allocated_size, format_size
+
+
+class CompressBenchmark:
+    def __init__(self, args):
+        self.args = args
+
+    def sample(self, tmpdir):
+        """
+        Create qcow2 image with a mixture of unallocated space, zeroes,
+        compressible text and random data similar to a guest disk.
+        """
+        if self.args.image is not None:
+            return self.args.image
+
+        raw = f'{tmpdir}/sample.raw'
+        text = b''.join(
+            f'{i:08d} The quick brown fox jumps over the lazy dog.\n'.encode()
+            for i in range(1024 * 1024 // 32)
+        )[:1024 * 1024]
+
+        with open(raw, 'wb') as f:
+            for i in range(self.args.size):
+                kind = i % 4
+                if kind == 0:
+                    f.seek(1024 * 1024, os.SEEK_CUR)
+                elif kind == 1:
+                    f.write(bytes(1024 * 1024))
+                elif kind == 2:
+                    f.write(text)
+                else:
+                    f.write(os.urandom(1024 * 1024))
+
+            f.truncate()
+
+        path = f'{tmpdir}/sample.qcow2'
+        subprocess.run(['qemu-img', 'convert', '-O', 'qcow2', raw, path], check=True)
+        os.unlink(raw)
+
+        return path
+
+    def conversions(self):
+        for (coroutines, out_of_order, compression, cluster_size) in itertools.product(
+            self.args.coroutines,
+            [False, True] if self.args.out_of_order else [False],
+            self.args.compression,
+            self.args.cluster_sizes
+        ):
+            yield QcowConversion(coroutines, out_of_order, compression, cluster_size)
+
+    def run(self):
+        with tempfile.TemporaryDirectory(dir=self.args.tmpdir) as tmpdir:
+            source = self.sample(tmpdir)
+            size = allocated_size(source)
+
+            print(f'Image: {source} ({format_size(size)} allocated)')
+            print('{:40s} {:>10s} {:>12s} {:>8s} {:>10s}'.format(
+                'settings', 'wall [s]', 'size', 'ratio', 'MB/s'
+            ))
+
+            for conversion in self.conversions():
+                destination = f'{tmpdir}/converted.qcow2'
+                start = time.monotonic()
+                subprocess.run(conversion.command(source, destination), check=True)
+                duration = time.monotonic() - start
+
+                converted = allocated_size(destination)
+                os.unlink(destination)
+
+                print('{:40s} {:10.3f} {:>12s} {:8.2f} {:10.1f}'.format(
+                    str(conversion), duration, format_size(converted),
+                    converted / size, size / duration / 1e6
+                ), flush=True)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Image compression benchmark')
+
+    parser.add_argument(
+        '--image', type=str, default=None,
+        help='Use existing image instead of a generated sample'
+    )
+
+    parser.add_argument(
+        '--size', type=int, default=1024, metavar='MiB',
+        help='Virtual size of generated sample image (Default 1024)'
+    )
+
+    parser.add_argument(
+        '--tmpdir', type=str, default=None,
+        help='Directory for sample and converted images, it should be on the '
+             'same storage as the libvirt pool (Default system temp directory)'
+    )
+
+    parser.add_argument(
+        '--coroutines', nargs='+', type=int, default=[1, 8],
+        help='Number of qemu-img coroutines (Default 1 8)'
+    )
+
+    parser.add_argument(
+        '--out-of-order', action='store_true', dest='out_of_order',
+        help='Measure also out of order writes'
+    )
+
+    parser.add_argument(
+        '--compression', nargs='+', default=['none', 'zlib'],
+        choices=QcowConversion.CompressionTypes,
+        help='Compression types (Default none zlib)'
+    )
+
+    parser.add_argument(
+        '--cluster-sizes', nargs='+', default=[None], dest='cluster_sizes',
+        help='qcow2 cluster sizes, e.g. 64k 2M (Default qemu-img default)'
+    )
+
+    CompressBenchmark(parser.parse_args(argv)).run()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,142 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+#    Authors:
+#        Pavel Březina <pbrezina@redhat.com>
+#
+#    Copyright (C) 2019 Red Hat
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+"""
+Measure latency of running a command on a guest with 'vagrant ssh', which
+is what 'ssh' and 'tests run' used to do, and with ssh called directly using
+cached 'vagrant ssh-config' output, with and without connection multiplexing.
+The guest must be running.
+
+Run from the cli directory:
+
+    python3 -m benchmarks.ssh --repeat 20 client
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from util.sshconfig import SSHConfigCache
+
+
+class SSHBenchmark:
+    def __init__(self, args):
+        self.args = args
+        self.project_dir = os.path.abspath(
+            os.path.dirname(os.path.realpath(__file__)) + '/../..'
+        )
+
+        self.env = {
+            **os.environ,
+            'VAGRANT_CWD': self.project_dir,
+            'SSSD_TEST_SUITE_CONFIG': os.environ.get(
+                'SSSD_TEST_SUITE_CONFIG', f'{self.project_dir}/config.json'
+            ),
+        }
+
+    def vagrant(self, argv):
+        return subprocess.run(
+            ['vagrant', *argv], env=self.env, check=True, text=True,
+            stdout=subprocess.PIPE
+        ).stdout
+
+    def measure(self, command):
+        timings = []
+        for _ in range(self.args.repeat):
+            start = time.monotonic()
+            subprocess.run(command, env=self.env, check=True, stdout=subprocess.DEVNULL)
+            timings.append(time.monotonic() - start)
+
+        return timings
+
+    def run(self):
+        guest = self.args.guest
+        command = self.args.command.split(' ')
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache = SSHConfigCache(
+                self.project_dir, cache_dir=tmpdir, control_dir=f'{tmpdir}/cm'
+            )
+
+            start = time.monotonic()
+            cache.store(guest, self.vagrant(['ssh-config', guest]))
+            resolve = time.monotonic() - start
+
+            direct = [
+                'ssh', '-F', cache.path(guest), '-o', 'ControlMaster=no',
+                '-o', 'ControlPath=none', guest, *command
+            ]
+
+            benchmarks = [
+                ('vagrant ssh', ['vagrant', 'ssh', guest, '--', *command]),
+                ('ssh', direct),
+                ('ssh multiplexed', cache.ssh_command(guest, command)),
+            ]
+
+            print(f'Guest: {guest}, command: {self.args.command}')
+            print('vagrant ssh-config: {:.1f} ms (once per boot)'.format(resolve * 1000))
+            print('{:16s} {:>10s} {:>10s} {:>10s}'.format(
+                'method', 'min [ms]', 'median', 'max'
+            ))
+
+            try:
+                for (name, argv) in benchmarks:
+                    timings = self.measure(argv)
+                    print('{:16s} {:10.1f} {:10.1f} {:10.1f}'.format(
+                        name, min(timings) * 1000,
+                        statistics.median(timings) * 1000, max(timings) * 1000
+                    ), flush=True)
+            finally:
+                subprocess.run(
+                    cache.control_command(guest), stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL
+                )
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='SSH latency benchmark')
+
+    parser.add_argument(
+        'guest', nargs='?', default='client',
+        help='Running guest to connect to (Default client)'
+    )
+
+    parser.add_argument(
+        '--command', type=str, default='true',
+        help='Command to run on the guest (Default true)'
+    )
+
+    parser.add_argument(
+        '--repeat', type=int, default=10,
+        help='Number of runs of each method (Default 10)'
+    )
+
+    SSHBenchmark(parser.parse_args(argv)).run()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -20,11 +20,19 @@
 #
 
 import argparse
+import contextlib
 import datetime
-import hashlib
+import functools
+import inspect
+import json
 import os
 import re
+import shutil
+import tempfile
 import textwrap
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import nutcli
 from nutcli.commands import Command, CommandParser
@@ -36,14 +44,133 @@ from commands.vagrant import (VagrantDestroyActor, VagrantHaltActor,
                               VagrantPackageActor, VagrantPruneActor,
                               VagrantUpActor, VagrantUpdateActor)
 from util.actor import TestSuiteActor
+from util.boxfile import BoxArchive
+from util.checksum import Checksum, ChecksumCache
+from util.fingerprint import BoxFingerprints, GuestFingerprint
+from util.image import QcowConversion, allocated_size, format_size
+
+
+class BoxPipeline(object):
+    """
+    Run box creation of several guests concurrently. Stages that run or
+    manipulate the virtual machine and stages that read and write the
+    whole disk image are limited separately.
+    """
+
+    def __init__(self, jobs=1, vm_jobs=None, io_jobs=1):
+        self.jobs = jobs
+        self.limits = {
+            'vm': threading.BoundedSemaphore(vm_jobs if vm_jobs else jobs),
+            'io': threading.BoundedSemaphore(io_jobs),
+        }
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+        self.events = []
+
+    @contextlib.contextmanager
+    def stage(self, guest, name, kind=None, image=None):
+        queued = time.monotonic()
+        limit = self.limits.get(kind, contextlib.nullcontext())
+        with limit:
+            start = time.monotonic()
+            written = self.bytes_written()
+            before = allocated_size(image) if image is not None else None
+            try:
+                yield
+            finally:
+                end = time.monotonic()
+                after = allocated_size(image) if image is not None else None
+                if written is not None:
+                    written = self.bytes_written() - written
+
+                # Guest writes are done by qemu under libvirtd and are not
+                # accounted to us, count at least the growth of the image.
+                if kind == 'vm' and before is not None and after is not None:
+                    written = (written or 0) + max(0, after - before)
+
+                with self.lock:
+                    self.events.append((
+                        guest, name, kind,
+                        queued - self.start,
+                        start - queued,
+                        end - start,
+                        written,
+                        after
+                    ))
+
+    def bytes_written(self):
+        # Includes all threads and finished child processes, e.g. qemu-img.
+        try:
+            with open('/proc/self/io') as f:
+                for line in f:
+                    (key, value) = line.split(':')
+                    if key == 'write_bytes':
+                        return int(value)
+        except (OSError, ValueError):
+            pass
+
+        return None
+
+    def run(self, boxes, task):
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            futures = {
+                box.guest: executor.submit(box.get_tasklist().execute, parent=task)
+                for box in boxes
+            }
+
+            for guest, future in futures.items():
+                if future.exception() is not None:
+                    failed.append(guest)
+
+        if failed:
+            raise RuntimeError('Unable to create boxes of: {}'.format(
+                ', '.join(failed)
+            ))
+
+    def timeline(self, task):
+        def fmt(seconds):
+            hours, remainder = divmod(int(seconds), 3600)
+            minutes, seconds = divmod(remainder, 60)
+            return f'{hours:02}:{minutes:02}:{seconds:02}'
+
+        with self.lock:
+            events = sorted(self.events, key=lambda x: (x[0], x[3]))
+
+        line = '{:10s} {:30s} {:>8s} {:>8s} {:>8s} {:>12s} {:>12s}'
+        task.info(line.format(
+            'guest', 'stage', 'start', 'wait', 'duration', 'written', 'image'
+        ))
+
+        for (guest, name, kind, start, wait, duration, written, image) in events:
+            task.info(line.format(
+                guest, name, fmt(start), fmt(wait), fmt(duration),
+                format_size(written), format_size(image)
+            ))
+
+        task.info('Total time: {}'.format(fmt(time.monotonic() - self.start)))
+        if self.jobs > 1:
+            task.info('Written bytes include all concurrently running stages.')
 
 
 class VagrantBox(object):
     def __init__(
         self, actor, guest, project_dir,
-        argv, version, linux, windows, output_dir
+        argv, version, linux, windows, output_dir, pipeline=None,
+        sparsify='guest', conversion=None, packaging='vagrant',
+        compress_level=6, metadata_url='http://', layered=False,
+        journal=None
     ):
         self.actor = actor
+        self.journal = journal
+        self.layered = layered
+        self.packaging = packaging
+        self.compress_level = compress_level
+        self.metadata_url = metadata_url
+        self.sparsify = sparsify
+        self.conversion = conversion if conversion is not None else QcowConversion()
+        self.fingerprint = None
+        self.pipeline = pipeline if pipeline is not None else BoxPipeline()
         self.shell = actor.shell
         self.logger = actor.logger
         self.project_dir = project_dir
@@ -62,24 +189,105 @@ class VagrantBox(object):
         self.output_dir = output_dir
         self.argv = argv
 
-    def _make_readable(self):
+    def _make_readable(self, task):
         self.shell(f'sudo chmod a+r {self.image_path}')
+        if not self.layered:
+            return
+
+        # The whole backing chain is read when the image is exported.
+        for path in self._backing_files():
+            task.info(f'Image is an overlay of {path}')
+            self.shell(['sudo', 'chmod', 'a+r', path])
+
+    def _backing_files(self):
+        result = self.shell(
+            ['qemu-img', 'info', '--backing-chain', '--output=json', self.image_path],
+            capture_output=True, effect=nutcli.shell.Shell.Effect.LogExecution
+        )
+
+        return [image['filename'] for image in json.loads(result.stdout)[1:]]
+
+    def _export_image(self, task):
+        # The exported copy is cleaned by virt-sysprep, the image of the
+        # guest must stay untouched.
+        path = f'{self.output_dir}/.{os.path.splitext(self.box_name)[0]}.img'
+        if self.layered:
+            task.info(f'Exporting flattened image with {self.conversion}')
+            self.shell(self.conversion.command(self.image_path, path))
+        else:
+            task.info('Copying image')
+            self.shell(['cp', '--sparse=always', '--reflink=auto', self.image_path, path])
+
+        return path
 
     def _zero_disk(self):
+        argv = nutcli.utils.get_as_list(self.argv)
+        if self.sparsify == 'host':
+            # Unused blocks are discarded later by _sparsify_image.
+            argv = [*argv, '--extra-vars', 'box_zero_disk=false']
+
         ProvisionGuestsActor(parent=self.actor)(
             guests=[self.guest],
-            argv=self.argv,
+            argv=argv,
             playbook=f'{self.project_dir}/provision/prepare-box.yml'
         )
 
-    def _compress_image(self):
-        self.shell(f'mv -f "{self.image_path}" "{self.image_path}.bak"')
-        self.shell(f'qemu-img convert -O qcow2 "{self.image_path}.bak" "{self.image_path}"')
-        self.shell(f'rm -f "{self.image_path}.bak"')
+    def _sparsify_image(self):
+        # The direct backend runs the appliance as our child process so its
+        # writes are accounted in the stage report. Sudo resets environment
+        # so the backend is passed through env.
+        self.shell([
+            'sudo', 'env', 'LIBGUESTFS_BACKEND=direct',
+            'virt-sparsify', '--in-place', self.image_path
+        ])
+
+    def _compress_image(self, task):
+        # The image is converted into a temporary file in the same directory
+        # and renamed over the original, so it is never left missing.
+        tmp = f'{self.image_path}.tmp'
+        before = allocated_size(self.image_path)
+        estimate = self._measure_image()
+
+        task.info(f'Converting image with {self.conversion}')
+        task.info('Allocated size: {}, estimated size after conversion: {}{}'.format(
+            format_size(before), format_size(estimate),
+            ' (without compression)' if self.conversion.compression != 'none' else ''
+        ))
+
+        try:
+            self.shell(self.conversion.command(self.image_path, tmp))
+            self.shell(['mv', '-f', tmp, self.image_path])
+        except BaseException:
+            self.shell(['rm', '-f', tmp])
+            raise
+
+        after = allocated_size(self.image_path)
+        if before is not None and after is not None:
+            task.info('Allocated size: {}, saved {}'.format(
+                format_size(after), format_size(before - after)
+            ))
+
+    def _measure_image(self):
+        try:
+            result = self.shell(
+                self.conversion.measure_command(self.image_path),
+                capture_output=True
+            )
+        except nutcli.shell.ShellCommandError:
+            return None
+
+        if not result.stdout:
+            return None
+
+        return self.conversion.parse_measure(result.stdout)
 
     def _package_box(self, task):
         self.shell(['mkdir', '-p', self.output_dir])
 
+        if self.packaging == 'stream':
+            self._stream_box(task)
+            return
+
         VagrantPackageActor(parent=self.actor)(
             guests=[self.guest],
             argv=['--vagrantfile', self.vagrant_file, '--output', self.box_name]
@@ -88,6 +296,96 @@ class VagrantBox(object):
         self.shell(f'mv -f "{self.box_name}" {self.output_dir}/')
         task.info(f'Box stored at {self.output_dir}/{self.box_name}')
 
+        # The box was just written so it is still in page cache, remember
+        # its checksum so it does not have to be computed again by
+        # 'box metadata' or 'cloud upload'.
+        self._cache_checksum(self.get_output_path())
+
+    @nutcli.decorators.SideEffect()
+    def _cache_checksum(self, path):
+        CreateMetadataActor(parent=self.actor).compute_checksum(path)
+
+    def _stream_box(self, task):
+        image = self._export_image(task)
+        try:
+            self._sysprep_image(task, image)
+
+            result = self.shell(
+                ['qemu-img', 'info', '--output=json', image],
+                capture_output=True
+            )
+
+            virtual_size = json.loads(result.stdout)['virtual-size'] if result.stdout else 0
+            archive = BoxArchive(
+                image, self.vagrant_file, virtual_size, self.compress_level
+            )
+
+            path = self.get_output_path()
+            checksum = self._write_box(archive, path)
+        finally:
+            self.shell(['rm', '-f', image])
+
+        task.info(f'Box stored at {path}')
+        task.info(f'SHA256: {checksum}')
+
+        metadata = CreateMetadataActor(parent=self.actor)
+        outfile = f'{os.path.splitext(path)[0]}.json'
+        metadata.write_metadata(outfile, metadata.get_metadata(
+            self.metadata_url, outfile, self.os, self.guest, self.version,
+            {'sha256': checksum}
+        ))
+        task.info(f'Metadata stored at {outfile}')
+
+    def _sysprep_image(self, task, image):
+        # Same as vagrant-libvirt does in vagrant package.
+        if shutil.which('virt-sysprep') is None:
+            task.warning('virt-sysprep is not available, image is not cleaned up')
+            return
+
+        operations = os.environ.get(
+            'VAGRANT_LIBVIRT_VIRT_SYSPREP_OPERATIONS', 'defaults,-ssh-userdir'
+        )
+
+        self.shell([
+            'sudo', 'env', 'LIBGUESTFS_BACKEND=direct',
+            'virt-sysprep', '--no-logfile', '--operations', operations,
+            '-a', image
+        ])
+
+        self.shell(['sudo', 'chmod', 'a+r', image])
+
+    @nutcli.decorators.SideEffect(returns='')
+    def _write_box(self, archive, path):
+        checksum = archive.write(path)
+        CreateMetadataActor(parent=self.actor).cache_checksums(
+            path, {'sha256': checksum}
+        )
+
+        return checksum
+
+    def _checkpoint(self, name, handler, *args, record=True):
+        if self.journal is None:
+            return functools.partial(handler, *args)
+
+        key = self.journal.key(
+            'box', self.guest, self.box_name, name, self.argv,
+            self.get_fingerprint_options()
+        )
+
+        return self.journal.checkpoint(key, handler, *args, record=record)
+
+    def _stage(self, kind, handler, *args):
+        accepts_task = 'task' in inspect.signature(handler).parameters
+
+        def run(task):
+            with self.pipeline.stage(self.guest, task.name, kind, self.image_path):
+                if accepts_task:
+                    handler(*args, task=task)
+                else:
+                    handler(*args)
+
+        return run
+
     def get_tasklist(self):
         return TaskList(
             tag=self.guest,
@@ -95,28 +393,56 @@ class VagrantBox(object):
             logger=self.logger
         )([
             Task('Make image readable')(
-                self._make_readable
+                self._stage(None, self._make_readable)
             ),
             Task('Start guest')(
-                VagrantUpActor(parent=self.actor), [self.guest]
+                self._stage('vm', self._checkpoint(
+                    'halt', VagrantUpActor(parent=self.actor), [self.guest],
+                    record=False
+                ))
             ),
-            Task('Zero out empty space on disk')(
-                self._zero_disk
+            Task('Zero out empty space on disk' if self.sparsify == 'guest' else 'Prepare guest')(
+                self._stage('vm', self._checkpoint('zero', self._zero_disk))
             ),
             Task('Halt guest')(
-                VagrantHaltActor(parent=self.actor), [self.guest]
+                self._stage('vm', self._checkpoint(
+                    'halt', VagrantHaltActor(parent=self.actor), [self.guest]
+                ))
+            ),
+            Task('Discard unused blocks on host', enabled=self.sparsify == 'host')(
+                self._stage('io', self._checkpoint('sparsify', self._sparsify_image))
             ),
-            Task('Compress image')(
-                self._compress_image
+            Task('Compress image', enabled=not self.layered)(
+                self._stage('io', self._checkpoint('compress', self._compress_image))
             ),
             Task('Package box')(
-                self._package_box
+                self._stage('io', self._checkpoint('package', self._package_box))
+            ),
+            Task('Record fingerprint', enabled=self.fingerprint is not None)(
+                self._stage(None, self._record_fingerprint)
             ),
         ])
 
     def get_output_path(self):
         return f'{self.output_dir}/{self.box_name}'
 
+    def get_fingerprint_options(self):
+        return {
+            'os': self.os,
+            'vagrantfile': os.path.relpath(self.vagrant_file, self.project_dir),
+            'sparsify': self.sparsify,
+            'conversion': str(self.conversion),
+            'packaging': self.packaging,
+            'layered': self.layered,
+        }
+
+    @nutcli.decorators.SideEffect()
+    def _record_fingerprint(self):
+        (fingerprint, inputs) = self.fingerprint
+        BoxFingerprints(self.output_dir).record(
+            self.guest, fingerprint, self.box_name, inputs
+        )
+
 
 class CreateBoxActor(TestSuiteActor):
     def __init__(self, *args, **kwargs):
@@ -162,6 +488,100 @@ class CreateBoxActor(TestSuiteActor):
             help='Run operation on guests in sequence (one by one)'
         )
 
+        parser.add_argument(
+            '--sparsify', action='store', type=str, dest='sparsify',
+            choices=['guest', 'host'], default='guest',
+            help='How is unused disk space cleared before compression. '
+                 '"guest" fills it with zeros inside the running guest, '
+                 '"host" discards unused blocks of the halted image with '
+                 'virt-sparsify (Default guest)'
+        )
+
+        parser.add_argument(
+            '--convert-coroutines', action='store', type=int,
+            dest='convert_coroutines', default=8,
+            help='Number of parallel coroutines used by qemu-img convert '
+                 'when compressing image (Default 8)'
+        )
+
+        parser.add_argument(
+            '--convert-out-of-order', action='store_true',
+            dest='convert_out_of_order',
+            help='Allow qemu-img convert to write image clusters out of order'
+        )
+
+        parser.add_argument(
+            '--compression', action='store', type=str, dest='compression',
+            choices=QcowConversion.CompressionTypes, default='none',
+            help='Write compressed qcow2 image with given compression type. '
+                 'zstd requires qemu 5.1 or newer (Default none)'
+        )
+
+        parser.add_argument(
+            '--cluster-size', action='store', type=str, dest='cluster_size',
+            help='Cluster size of the qcow2 image, e.g. 64k or 2M '
+                 '(Default qemu-img default)'
+        )
+
+        parser.add_argument(
+            '--package', action='store', type=str, dest='packaging',
+            choices=['vagrant', 'stream'], default='vagrant',
+            help='How is the box packaged. "vagrant" uses vagrant package, '
+                 '"stream" writes the box directly into output directory '
+                 'together with its metadata (Default vagrant)'
+        )
+
+        parser.add_argument(
+            '--package-compress-level', action='store', type=int,
+            dest='compress_level', choices=range(0, 10), default=6,
+            metavar='0-9',
+            help='Gzip compression level of the box with --package=stream, '
+                 '0 writes uncompressed tar archive (Default 6)'
+        )
+
+        parser.add_argument(
+            '-u', '--url', action='store', type=str, dest='url',
+            default='http://',
+            help='URL where the box will be available, used in metadata '
+                 'written with --package=stream'
+        )
+
+        parser.add_argument(
+            '-r', '--resume', action='store_true', dest='resume',
+            help='Skip tasks that have finished in the last run of this '
+                 'command with the same arguments'
+        )
+
+        parser.add_argument(
+            '--layered', action='store_true', dest='layered',
+            help='Keep guest images in the storage pool as overlays of the '
+                 'shared base box image, flatten them only when the box is '
+                 'exported'
+        )
+
+        parser.add_argument(
+            '-i', '--incremental', action='store_true', dest='incremental',
+            help='Create boxes only for guests whose fingerprint differs from '
+                 'the last box created in the output directory'
+        )
+
+        parser.add_argument(
+            '-j', '--jobs', action='store', type=int, dest='jobs', default=1,
+            help='Number of boxes that are created concurrently (Default 1)'
+        )
+
+        parser.add_argument(
+            '--vm-jobs', action='store', type=int, dest='vm_jobs',
+            help='Maximum number of guests that are started, zeroed out or '
+                 'halted at the same time (Default is --jobs)'
+        )
+
+        parser.add_argument(
+            '--io-jobs', action='store', type=int, dest='io_jobs', default=1,
+            help='Maximum number of images that are compressed or packaged '
+                 'at the same time (Default 1)'
+        )
+
         parser.add_argument(
             'guests', nargs='*', choices=['all'] + self.AllGuests,
             action=UniqueAppendAction, default='all',
@@ -187,6 +607,46 @@ class CreateBoxActor(TestSuiteActor):
         you have passwordless sudo.
 
         Creating new boxes takes some time, so be patient.
+
+        Boxes of multiple guests can be created concurrently with --jobs.
+        Starting, zeroing out and halting guests is limited by --vm-jobs,
+        compressing and packaging images is limited by --io-jobs since these
+        stages read and write the whole disk image. A timeline of all stages
+        is printed at the end. Passwordless sudo is recommended when --jobs
+        is set.
+
+        With --sparsify=host the guest does not fill its disk with zeros,
+        instead unused blocks are discarded from the halted image with
+        virt-sparsify --in-place (libguestfs) on the host. If virt-sparsify
+        is not available, the zero fill inside the guest is used.
+
+        The halted image is converted by qemu-img into a temporary file next
+        to it which is then renamed over the original image. Use
+        --convert-coroutines, --convert-out-of-order, --compression and
+        --cluster-size to tune the conversion.
+
+        With --package=stream the box archive is written directly into the
+        output directory while its SHA256 checksum is computed. Metadata file
+        (see 'box metadata') is written next to it and the checksum is cached
+        so 'box metadata' and 'cloud upload' do not read the box again.
+
+        With --incremental a fingerprint of each guest is computed from its
+        base box version, its configuration, playbooks and Ansible roles that
+        are applied to the guest, variables.yml and box options. Guests whose
+        fingerprint matches the last box recorded in the output directory
+        (fingerprints.json) are skipped, including provisioning from scratch.
+
+        With --layered the guest images in the storage pool stay qcow2
+        overlays of the base box image that is shared by all guests created
+        from the same box. The image is not compressed in the pool, instead
+        it is flattened when the box is exported: by vagrant package with
+        --package=vagrant or by qemu-img convert with the conversion options
+        into a temporary image in the output directory with --package=stream.
+
+        Finished tasks are recorded in a journal in the project directory
+        until all boxes are created. If the command fails, run it again with
+        --resume to skip tasks that have already finished, e.g. provisioning
+        or zeroing out disk space.
         ''')
 
     def __call__(
@@ -199,34 +659,151 @@ class CreateBoxActor(TestSuiteActor):
         update,
         sequence,
         guests,
-        argv
+        argv,
+        jobs=1,
+        vm_jobs=None,
+        io_jobs=1,
+        sparsify='guest',
+        convert_coroutines=8,
+        convert_out_of_order=False,
+        compression='none',
+        cluster_size=None,
+        packaging='vagrant',
+        compress_level=6,
+        url='http://',
+        incremental=False,
+        layered=False,
+        resume=False
     ):
         guests = guests if 'all' not in guests else self.AllGuests
         guests.sort()
 
+        if sparsify == 'host' and shutil.which('virt-sparsify') is None:
+            self.warning('virt-sparsify is not available, '
+                         'zeroing out disk space inside guests instead')
+            sparsify = 'guest'
+
+        journal = self.get_journal('box-create', resume)
+        pipeline = BoxPipeline(jobs, vm_jobs, io_jobs)
+        conversion = QcowConversion(
+            convert_coroutines, convert_out_of_order, compression, cluster_size
+        )
+
         boxes = [VagrantBox(
-            self, guest, self.project_dir, argv, version, linux, windows, output_dir
+            self, guest, self.project_dir, argv, version, linux, windows,
+            output_dir, pipeline, sparsify, conversion, packaging,
+            compress_level, url, layered, journal
         ) for guest in guests]
 
+        if incremental:
+            if scratch and update:
+                # Fingerprint must include the updated base box version.
+                VagrantUpdateActor(parent=self)(guests, sequence)
+                update = False
+
+            boxes = self.select_changed(boxes, output_dir, scratch)
+            if not boxes:
+                self.info('All boxes are up to date.')
+                return
+
+            guests = [box.guest for box in boxes]
+
+        if jobs > 1:
+            create_boxes = [
+                Task('Create boxes concurrently')(pipeline.run, boxes)
+            ]
+        else:
+            create_boxes = [box.get_tasklist() for box in boxes]
+
         TaskList('Create Boxes', logger=self.logger)([
             TaskList(name='Provision from scratch', enabled=scratch)([
-                Task('Destroy guests')(
+                Task('Destroy guests')(journal.checkpoint(
+                    journal.key('destroy', guests),
                     VagrantDestroyActor(parent=self), guests, sequence
-                ),
-                Task('Update boxes', enabled=update)(
+                )),
+                Task('Update boxes', enabled=update)(journal.checkpoint(
+                    journal.key('update', guests),
                     VagrantUpdateActor(parent=self), guests, sequence
-                ),
-                Task('Bring up guests')(
-                    VagrantUpActor(parent=self), guests, sequence
-                ),
-                Task('Provision guests')(
+                )),
+                Task('Bring up guests')(journal.checkpoint(
+                    journal.key('provision', guests, argv),
+                    VagrantUpActor(parent=self), guests, sequence,
+                    record=False
+                )),
+                Task('Provision guests')(journal.checkpoint(
+                    journal.key('provision', guests, argv),
                     ProvisionGuestsActor(parent=self), guests, argv=argv
-                ),
+                )),
             ]),
-            *[box.get_tasklist() for box in boxes],
-            Task('Output information')(self.display_output, boxes)
+            *create_boxes,
+            Task('Output information')(self.display_output, boxes),
+            Task('Remove journal')(self.finish_journal, journal),
+            Task.Cleanup('Print timeline')(pipeline.timeline),
         ]).execute()
 
+    def select_changed(self, boxes, output_dir, scratch):
+        fingerprint = GuestFingerprint(self.project_dir, self.get_config_file(), [
+            f'{self.ansible_dir}/prepare-guests.yml',
+            f'{self.ansible_dir}/prepare-box.yml',
+        ])
+
+        fingerprints = BoxFingerprints(output_dir)
+        installed = self.get_installed_boxes() if scratch else {}
+
+        changed = []
+        for box in boxes:
+            if scratch:
+                name = (fingerprint.config(box.guest) or {}).get('name')
+                base = {'name': name, 'version': installed.get(name)}
+            else:
+                base = self.get_machine_box(box.guest)
+
+            box.fingerprint = fingerprint.compute(
+                box.guest, base, box.get_fingerprint_options()
+            )
+
+            if fingerprints.is_built(box.guest, box.fingerprint[0]):
+                self.info('{}: {} is up to date, skipping'.format(
+                    box.guest, fingerprints.last_box(box.guest)
+                ))
+                continue
+
+            self.info(f'{box.guest}: fingerprint has changed')
+            changed.append(box)
+
+        return changed
+
+    def get_machine_box(self, guest):
+        path = f'{self.vagrant_dir}/.vagrant/machines/{guest}/libvirt/box_meta'
+        try:
+            with open(path) as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        return {'name': meta.get('name'), 'version': meta.get('version')}
+
+    def get_installed_boxes(self):
+        def version_key(version):
+            return [
+                (0, int(x)) if x.isdigit() else (1, x)
+                for x in re.split(r'[.-]', version)
+            ]
+
+        result = self.shell(
+            ['vagrant', 'box', 'list'], capture_output=True,
+            effect=nutcli.shell.Shell.Effect.LogExecution
+        )
+
+        boxes = {}
+        for (name, version) in re.findall(
+            r'^(\S+)\s+\(libvirt, ([^)]+)\)$', result.stdout, re.MULTILINE
+        ):
+            if name not in boxes or version_key(version) > version_key(boxes[name]):
+                boxes[name] = version
+
+        return boxes
+
     def display_output(self, boxes, task):
         for box in boxes:
             task.info(f'Box written: {box.get_output_path()}')
@@ -235,6 +812,7 @@ class CreateBoxActor(TestSuiteActor):
 class CreateMetadataActor(TestSuiteActor):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        self.checksum_cache_file = f'{self.vagrant_dir}/box-checksum-cache.json'
 
     def setup_parser(self, parser):
         parser.add_argument(
@@ -252,11 +830,37 @@ class CreateMetadataActor(TestSuiteActor):
             help='Print metadata to stdout instead of writing it to file',
         )
 
+        parser.add_argument(
+            '-d', '--digest', action=UniqueAppendAction, type=str,
+            dest='digests', choices=Checksum.Algorithms, default=None,
+            help='Checksum type to include in metadata. The first one is '
+                 'used as the provider checksum, others are listed in '
+                 '"checksums". Multiple digests can be set. (Default sha256)'
+        )
+
+        parser.add_argument(
+            '--read-method', action='store', type=str, dest='read_method',
+            choices=Checksum.Methods, default='read',
+            help='How is the box file read: "read" uses large blocks read '
+                 'in a background thread, "mmap" maps the file into memory '
+                 '(Default read)'
+        )
+
+        parser.add_argument(
+            '--no-cache', action='store_false', dest='use_cache',
+            help='Always compute checksums from box content, do not use '
+                 'or update the local checksum cache'
+        )
+
         parser.add_argument(
             'box', help='Vagrant box file.'
         )
 
-    def __call__(self, url, output, box, print_content):
+    def __call__(
+        self, url, output, box, print_content,
+        digests=None, read_method='read', use_cache=True
+    ):
+        digests = digests if digests else ['sha256']
         outfile = output
         if outfile is None:
             outfile = f'{os.path.splitext(box)[0]}.json'
@@ -267,9 +871,9 @@ class CreateMetadataActor(TestSuiteActor):
             r'sssd-(.*)-(.*)-(.*)', box_name
         )[0]
 
-        checksum = self.compute_checksum(box)
+        checksums = self.compute_checksums(box, digests, read_method, use_cache)
         content = self.get_metadata(
-            url, outfile, box_os, box_guest, box_version, checksum
+            url, outfile, box_os, box_guest, box_version, checksums
         )
 
         if print_content:
@@ -279,41 +883,60 @@ class CreateMetadataActor(TestSuiteActor):
         self.write_metadata(outfile, content)
         return 0
 
-    def compute_checksum(self, path, block_size=65536):
-        sha256 = hashlib.sha256()
-        with open(path, 'rb') as f:
-            for block in iter(lambda: f.read(block_size), b''):
-                sha256.update(block)
-
-        return sha256.hexdigest()
-
-    def get_metadata(self, url, outfile, os, guest, version, checksum):
-        return textwrap.dedent('''
-        {{
-            "name": "sssd-{os}-{guest}",
-            "description": "SSSD Test Suite '{os}' {guest}",
-            "versions": [
-                {{
-                    "version": "{version}",
-                    "status": "active",
-                    "providers": [
-                        {{
-                            "name": "libvirt",
-                            "url": "{url}/sssd-{os}-{guest}-{version}.box",
-                            "checksum_type": "sha256",
-                            "checksum": "{checksum}"
-                        }}
-                    ]
-                }}
-            ]
-        }}
-        ''').strip().format(
-            os=os,
-            guest=guest,
-            version=version,
-            url=url,
-            checksum=checksum
-        )
+    def compute_checksum(self, path, algorithm='sha256', use_cache=True):
+        return self.compute_checksums(
+            path, [algorithm], use_cache=use_cache
+        )[algorithm]
+
+    def cache_checksums(self, path, checksums):
+        cache = ChecksumCache(self.checksum_cache_file).load()
+        cache.store(path, checksums, os.stat(path))
+        cache.save()
+
+    def compute_checksums(self, path, algorithms, method='read', use_cache=True):
+        if not use_cache:
+            return Checksum(algorithms, method).compute(path)
+
+        cache = ChecksumCache(self.checksum_cache_file).load()
+        checksums = cache.lookup(path, algorithms)
+        if checksums is not None:
+            self.debug(f'Using cached checksum of {path}')
+            return checksums
+
+        stat = os.stat(path)
+        checksums = Checksum(algorithms, method).compute(path)
+        cache.store(path, checksums, stat)
+        cache.save()
+
+        return checksums
+
+    def get_metadata(self, url, outfile, os, guest, version, checksums):
+        return self.get_catalog(url, os, guest, {version: checksums})
+
+    def get_catalog(self, url, os, guest, versions):
+        return json.dumps({
+            'name': f'sssd-{os}-{guest}',
+            'description': f"SSSD Test Suite '{os}' {guest}",
+            'versions': [{
+                'version': version,
+                'status': 'active',
+                'providers': [self.get_provider(url, os, guest, version, checksums)]
+            } for version, checksums in versions.items()]
+        }, indent=4)
+
+    def get_provider(self, url, os, guest, version, checksums):
+        (checksum_type, checksum) = next(iter(checksums.items()))
+        provider = {
+            'name': 'libvirt',
+            'url': f'{url}/sssd-{os}-{guest}-{version}.box',
+            'checksum_type': checksum_type,
+            'checksum': checksum
+        }
+
+        if len(checksums) > 1:
+            provider['checksums'] = checksums
+
+        return provider
 
     @nutcli.decorators.SideEffect()
     def write_metadata(self, outfile, content):
@@ -321,9 +944,148 @@ class CreateMetadataActor(TestSuiteActor):
             f.write(content)
 
 
+class CreateCatalogActor(CreateMetadataActor):
+    def setup_parser(self, parser):
+        parser.add_argument(
+            '-u', '--url', action='store', type=str, dest='url',
+            help='URL where the boxes are available', default='http://'
+        )
+
+        parser.add_argument(
+            '-j', '--jobs', action='store', type=int, dest='jobs',
+            default=os.cpu_count(),
+            help='Number of boxes hashed in parallel (Default number of CPUs)'
+        )
+
+        parser.add_argument(
+            '-d', '--digest', action=UniqueAppendAction, type=str,
+            dest='digests', choices=Checksum.Algorithms, default=None,
+            help='Checksum type to include in metadata. Multiple digests can '
+                 'be set. (Default sha256)'
+        )
+
+        parser.add_argument(
+            '--no-cache', action='store_false', dest='use_cache',
+            help='Always compute checksums from box content, do not use '
+                 'or update the local checksum cache'
+        )
+
+        parser.add_argument(
+            'directory', help='Directory with vagrant boxes.'
+        )
+
+        parser.epilog = textwrap.dedent('''
+        Create one metadata file for each box name found in the directory.
+        The file $directory/sssd-$os-$guest.json lists all versions of the
+        box that are present in the directory.
+
+        Boxes are hashed in parallel and checksums are cached, therefore only
+        new boxes are read when the catalog is updated. Metadata files are
+        written only when they change, they are replaced atomically.
+        ''')
+
+    def __call__(self, url, directory, jobs=1, digests=None, use_cache=True):
+        digests = digests if digests else ['sha256']
+        boxes = self.find_boxes(directory)
+        if not boxes:
+            self.info(f'No boxes found in {directory}')
+            return 0
+
+        checksums = self.compute_catalog_checksums(
+            [path for path, _ in boxes], digests, jobs, use_cache
+        )
+
+        catalogs = {}
+        for (path, (box_os, box_guest, box_version)) in boxes:
+            catalogs.setdefault((box_os, box_guest), {})[box_version] = checksums[path]
+
+        for (box_os, box_guest), versions in sorted(catalogs.items()):
+            versions = dict(sorted(versions.items()))
+            outfile = f'{directory}/sssd-{box_os}-{box_guest}.json'
+            content = self.get_catalog(url, box_os, box_guest, versions)
+
+            if self.read_metadata(outfile) == content:
+                self.info(f'{outfile} is up to date ({len(versions)} versions)')
+                continue
+
+            self.replace_metadata(outfile, content)
+            self.info(f'{outfile} written ({len(versions)} versions)')
+
+        return 0
+
+    def find_boxes(self, directory):
+        guests = '|'.join(sorted(self.AllGuests, key=len, reverse=True))
+        regex = re.compile(rf'^sssd-(.+)-({guests})-([^-]+)\.box$')
+
+        boxes = []
+        for name in sorted(os.listdir(directory)):
+            match = regex.match(name)
+            if match is not None:
+                boxes.append((f'{directory}/{name}', match.groups()))
+
+        return boxes
+
+    def compute_catalog_checksums(self, paths, algorithms, jobs, use_cache):
+        cache = ChecksumCache(self.checksum_cache_file).load() if use_cache else None
+
+        checksums = {}
+        missing = []
+        for path in paths:
+            cached = cache.lookup(path, algorithms) if cache is not None else None
+            if cached is not None:
+                checksums[path] = cached
+            else:
+                missing.append(path)
+
+        self.info(f'Found {len(paths)} boxes, {len(missing)} of them need to be hashed')
+
+        def compute(path):
+            stat = os.stat(path)
+            result = Checksum(algorithms).compute(path)
+            if cache is not None:
+                cache.store(path, result, stat)
+
+            return result
+
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            for path, result in zip(missing, executor.map(compute, missing)):
+                self.info(f'Computed checksum of {path}')
+                checksums[path] = result
+
+        if cache is not None:
+            cache.save()
+
+        return checksums
+
+    def read_metadata(self, path):
+        try:
+            with open(path) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    @nutcli.decorators.SideEffect()
+    def replace_metadata(self, outfile, content):
+        (fd, tmp) = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(outfile)),
+            prefix=f'.{os.path.basename(outfile)}.'
+        )
+
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(content)
+
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, outfile)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+
 Commands = Command('box', 'Update and create boxes', CommandParser()([
     Command('update', 'Update vagrant box', VagrantUpdateActor()),
     Command('prune', 'Delete all outdated vagrant boxes', VagrantPruneActor()),
     Command('create', 'Create new vagrant box', CreateBoxActor()),
     Command('metadata', 'Create box metadata', CreateMetadataActor()),
+    Command('catalog', 'Create metadata of all boxes in directory', CreateCatalogActor()),
 ]))
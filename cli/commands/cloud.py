@@ -19,7 +19,9 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import asyncio
 import json
+import os
 import re
 import textwrap
 
@@ -27,8 +29,10 @@ from nutcli.commands import Command, CommandGroup, CommandParser
 from nutcli.parser import UniqueAppendAction
 from nutcli.tasks import Task, TaskList
 
+from commands.box import CreateMetadataActor
 from util.actor import TestSuiteActor
-from util.vgcloud import VagrantCloud
+from util.vgcloud import (AsyncVagrantCloud, ResponseCache, UploadProgress,
+                          VagrantCloud, VagrantCloudPruner)
 
 
 class CloudActor(TestSuiteActor):
@@ -36,6 +40,7 @@ class CloudActor(TestSuiteActor):
         super().__init__()
 
         self.cloud_config_file = '{}/vg-cloud.json'.format(self.vagrant_dir)
+        self.cloud_cache_file = '{}/vg-cloud-cache.json'.format(self.vagrant_dir)
 
     def setup_parser(self, parser):
         parser.add_argument(
@@ -70,9 +75,54 @@ class CloudActor(TestSuiteActor):
                 'token': token
             }))
 
-    def get_cloud_api(self, username, token):
+    def get_cloud_api(self, username, token, pool_size=10, retries=5, cache_ttl=None):
         (username, token) = self.get_credentials(username, token)
-        return VagrantCloud(username, token)
+
+        cache = None
+        if cache_ttl is not None:
+            cache = ResponseCache(self.cloud_cache_file, cache_ttl).load()
+
+        return VagrantCloud(
+            username, token, pool_size=pool_size, retries=retries,
+            url=os.environ.get('SSSD_TEST_SUITE_CLOUD_URL', None),
+            cache=cache
+        )
+
+
+class CloudApiActor(CloudActor):
+    def setup_parser(self, parser):
+        super().setup_parser(parser)
+
+        parser.add_argument(
+            '--pool-size', action='store', type=int, dest='pool_size',
+            default=10, help='Maximum number of persistent connections '
+            'kept open to vagrant cloud (Default 10)'
+        )
+
+        parser.add_argument(
+            '--stats', action='store_true', dest='stats',
+            help='Print request and latency statistics at the end'
+        )
+
+        parser.add_argument(
+            '--cache-ttl', action='store', type=int, dest='cache_ttl',
+            default=300, help='How many seconds are cached responses used '
+            'without revalidation (Default 300)'
+        )
+
+        parser.add_argument(
+            '--no-cache', action='store_const', const=None, dest='cache_ttl',
+            help='Do not use local cache of vagrant cloud responses'
+        )
+
+    def print_stats(self, api):
+        self.info('Vagrant cloud statistics:')
+        lines = api.stats.summary()
+        if api.cache is not None:
+            lines += api.cache.summary()
+
+        for line in lines:
+            self.info(f'  {line}')
 
 
 class CloudGetCredentialsActor(CloudActor):
@@ -90,14 +140,19 @@ class CloudSetCredentialsActor(CloudActor):
         self.save_credentials(username, token)
 
 
-class CloudListActor(CloudActor):
-    def __call__(self, username, token):
-        api = self.get_cloud_api(username, token)
-        for box in api.list_boxes():
-            print('- {:50s} ({})'.format(box.tag, box.version))
+class CloudListActor(CloudApiActor):
+    def __call__(self, username, token, pool_size=10, cache_ttl=300, stats=False):
+        api = self.get_cloud_api(username, token, pool_size, cache_ttl=cache_ttl)
+        try:
+            for box in api.iter_boxes():
+                print('- {:50s} ({})'.format(box.tag, box.version), flush=True)
+        finally:
+            if stats:
+                self.print_stats(api)
+            api.close()
 
 
-class CloudPruneActor(CloudActor):
+class CloudPruneActor(CloudApiActor):
     def setup_parser(self, parser):
         super().setup_parser(parser)
 
@@ -106,22 +161,60 @@ class CloudPruneActor(CloudActor):
             default=2, help='How many versions should be kept (Default 2)'
         )
 
+        parser.add_argument(
+            '-j', '--jobs', action='store', type=int, dest='jobs',
+            default=8, help='Number of concurrent requests (Default 8)'
+        )
+
+        parser.add_argument(
+            '-n', '--dry-run', action='store_true', dest='dry_run',
+            help='Only print versions that would be deleted'
+        )
+
         parser.description = textwrap.dedent('''
         This will iterate over all available boxes and delete outdated versions.
         Only last two versions (by default, can be set with --keep) will be
         kept.
         ''')
 
-    def __call__(self, username, token, keep=2):
-        api = self.get_cloud_api(username, token)
-        for box in api.list_boxes():
-            versions = api.list_versions(box.name)
-            for version in versions[:-keep]:
-                self.info(f'Removing {box.name} {version}')
-                api.version_delete(box.name, version)
+    def __call__(
+        self, username, token, keep=2, jobs=8, dry_run=False,
+        pool_size=10, cache_ttl=300, stats=False
+    ):
+        api = self.get_cloud_api(
+            username, token, max(pool_size, jobs), cache_ttl=cache_ttl
+        )
+        pruner = VagrantCloudPruner(api, keep=keep, jobs=jobs)
+
+        def deleted(name, version, error):
+            if name is None:
+                self.error(f'Unable to list boxes: {error}')
+            elif version is None:
+                self.error(f'Unable to list versions of {name}: {error}')
+            elif error is None:
+                self.info(f'Removed {name} {version}')
+            else:
+                self.error(f'Unable to remove {name} {version}: {error}')
+
+        try:
+            result = pruner.run(dry_run=dry_run, callback=deleted)
+
+            if dry_run:
+                for (name, version) in pruner.plan:
+                    self.info(f'Would remove {name} {version}')
+
+            self.info('Summary:')
+            for line in pruner.summary():
+                self.info(f'  {line}')
+        finally:
+            if stats:
+                self.print_stats(api)
+            api.close()
 
+        return 0 if result else 1
 
-class CloudUploadActor(CloudActor):
+
+class CloudUploadActor(CloudApiActor):
     def setup_parser(self, parser):
         super().setup_parser(parser)
 
@@ -130,6 +223,35 @@ class CloudUploadActor(CloudActor):
             help='Path to vagrant boxes that should be uploaded to cloud.'
         )
 
+        parser.add_argument(
+            '-j', '--jobs', action='store', type=int, dest='jobs',
+            default=1, help='Number of boxes uploaded in parallel (Default 1)'
+        )
+
+        parser.add_argument(
+            '--chunk-size', action='store', type=int, dest='chunk_size',
+            default=0, metavar='MiB', help='Upload boxes in chunks of given '
+            'size that can be resumed if the upload is interrupted. The '
+            'upload server must support ranged PUT requests'
+        )
+
+        parser.add_argument(
+            '--retries', action='store', type=int, dest='retries',
+            default=5, help='How many times a failed chunk is retried '
+            '(Default 5)'
+        )
+
+        parser.add_argument(
+            '-f', '--force', action='store_true', dest='force',
+            help='Upload boxes even if the same box is already uploaded'
+        )
+
+        parser.add_argument(
+            '--verify', action='store_true', dest='verify',
+            help='Check that the artifact is really available in vagrant '
+            'cloud before skipping the upload'
+        )
+
         parser.epilog = textwrap.dedent('''
         The box files names must be in the same format as is created by
         'box create' command. That is:
@@ -137,38 +259,145 @@ class CloudUploadActor(CloudActor):
 
         For example:
           sssd-fedora30-client-20190530.01.box
+
+        If --jobs is greater than one, multiple boxes are uploaded at the same
+        time. A failure to upload one box does not interrupt other uploads.
+
+        If --chunk-size is set, each box is uploaded in chunks and completed
+        chunks are recorded in $box.upload journal file. Chunks that fail
+        with server error or broken connection are retried with exponential
+        backoff. Running the same command again after an interrupted upload
+        resumes where it stopped. This requires an upload server that accepts
+        ranged PUT requests, Vagrant Cloud does not. The size of the stored
+        artifact is therefore checked before the version is released and the
+        upload fails if it does not match the local box.
+
+        SHA-256 checksum of each box is registered with the provider. If the
+        version is already released and its checksum matches the local box
+        the upload is skipped, unless --force is set. With --verify, the
+        provider download URL is checked as well and missing artifacts are
+        reported and uploaded again.
         ''')
 
-    def __call__(self, username, token, boxes):
-        api = self.get_cloud_api(username, token)
-        tasks = TaskList('Upload Box', logger=self.logger)
-        for box_file in boxes:
+    def __call__(
+        self, username, token, boxes, jobs=1, chunk_size=0, retries=5,
+        force=False, verify=False, pool_size=10, cache_ttl=300, stats=False,
+        checksum_cache=True
+    ):
+        api = self.get_cloud_api(
+            username, token, max(pool_size, jobs), retries, cache_ttl
+        )
+        self.chunk_size = chunk_size * 1024 * 1024
+        self.force = force
+        self.verify = verify
+        self.checksum_cache = checksum_cache
+        try:
+            if jobs > 1:
+                return self.parallel_upload(api, boxes, jobs)
+
+            tasks = TaskList('Upload Box', logger=self.logger)
+            for box_file in boxes:
+                info = self.get_box_info(box_file)
+                tasks.append(
+                    Task('Creating box {name} ({version})'.format(**info))(
+                        self.upload_task, api, box_file, info
+                    )
+                )
+
+            tasks.execute()
+        finally:
+            if stats:
+                self.print_stats(api)
+            api.close()
+
+    def parallel_upload(self, api, boxes, jobs):
+        progress = UploadProgress(len(boxes))
+
+        async def upload(cloud, box_file):
             info = self.get_box_info(box_file)
-            tasks.append(
-                Task('Creating box {name} ({version})'.format(**info))(
-                    self.upload_task, api, box_file, info
+            try:
+                await cloud.run(self.upload_task, api, box_file, info, progress)
+                progress.finish(box_file)
+            except Exception as e:
+                progress.finish(box_file, success=False)
+                self.error('Unable to upload {name} ({version}): {error}'.format(
+                    **info, error=f'{e.__class__.__name__}: {e}'
+                ))
+                return box_file
+
+            return None
+
+        async def upload_all():
+            with AsyncVagrantCloud(api, jobs) as cloud:
+                return await asyncio.gather(
+                    *[upload(cloud, box_file) for box_file in boxes]
                 )
-            )
-        tasks.execute()
 
-    def upload_task(self, api, box_file, info):
-        self.create_container(api, info)
-        self.upload(api, info, box_file)
+        failed = [box_file for box_file in asyncio.run(upload_all()) if box_file]
+        progress.done()
 
-    def create_container(self, api, info):
-        api.box_create(
-            info['name'], 'sssd-test-suite: {os} {guest} machine'.format(**info)
-        )
+        self.info(f'Uploaded {len(boxes) - len(failed)} of {len(boxes)} boxes.')
+        for box_file in failed:
+            self.error(f'  Failed: {box_file}')
+
+        return 1 if failed else 0
 
-        api.version_create(
-            info['name'], info['version'],
-            'See: https://github.com/SSSD/sssd-test-suite'
+    def upload_task(self, api, box_file, info, progress=None):
+        checksum = CreateMetadataActor(parent=self).compute_checksum(
+            box_file, use_cache=self.checksum_cache
         )
 
-        api.provider_create(info['name'], info['version'], 'libvirt')
+        with api.count_requests() as counter:
+            if not self.force and self.is_uploaded(api, info, checksum):
+                self.info('Box {name} ({version}) is already uploaded, '
+                          'skipping.'.format(**info))
+            else:
+                self.create_container(api, info, checksum)
+                self.upload(api, info, box_file, progress)
+
+        self.info('Box {name} ({version}) finished with {count} '
+                  'requests.'.format(**info, count=counter.requests))
+
+    def is_uploaded(self, api, info, checksum):
+        version = api.version_get(info['name'], info['version'])
+        if version is None or version['status'] != 'active':
+            return False
+
+        for provider in version['providers']:
+            if provider['name'] != 'libvirt':
+                continue
+
+            if provider.get('checksum_type') != 'sha256' \
+                    or provider.get('checksum') != checksum:
+                return False
+
+            if self.verify and not api.provider_artifact_exists(provider):
+                self.warning('Box {name} ({version}) has matching checksum '
+                             'but the artifact is missing.'.format(**info))
+                return False
+
+            return True
+
+        return False
+
+    def create_container(self, api, info, checksum=None):
+        api.ensure_container(
+            info['name'], info['version'], 'libvirt',
+            summary='sssd-test-suite: {os} {guest} machine'.format(**info),
+            description='See: https://github.com/SSSD/sssd-test-suite',
+            checksum=checksum
+        )
 
-    def upload(self, api, info, box_file):
-        api.provider_upload(info['name'], info['version'], 'libvirt', box_file)
+    def upload(self, api, info, box_file, progress=None):
+        if self.chunk_size:
+            api.provider_upload_chunked(
+                info['name'], info['version'], 'libvirt', box_file,
+                self.chunk_size, progress
+            )
+        else:
+            api.provider_upload(
+                info['name'], info['version'], 'libvirt', box_file, progress
+            )
         api.version_release(info['name'], info['version'])
 
     def get_box_info(self, box_file):
@@ -194,6 +423,10 @@ Commands = Command('cloud', 'Access vagrant cloud', CommandParser(
     username and access token. You can use 'set-creds' command to save
     these parameters in ./sssd-test-suite/vg-cloud.json. Please, keep in mind
     that authentication token is stored in plain text.
+
+    Box, version and provider metadata is cached in
+    ./sssd-test-suite/vg-cloud-cache.json. Cached entries are revalidated
+    with a conditional request once they are older than --cache-ttl seconds.
     '''))([
         CommandGroup('Cloud Operations')([
             Command('list', 'List boxes stored in vagrant cloud', CloudListActor()),
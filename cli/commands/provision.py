@@ -152,7 +152,8 @@ class EnrollActor(AnsibleActor):
         )
 
         parser.epilog = textwrap.dedent('''
-        This will start up selected guests and then finalize their provisioning.
+        This will start up selected guests that are not running and then
+        finalize their provisioning.
         Most of all it will enroll client into domains, but it also finishes
         preparation of IPA server. Actions that are executed depends on
         selected guests.
@@ -183,7 +184,7 @@ class EnrollActor(AnsibleActor):
     def __call__(self, guests, sequence, unattended, argv):
         TaskList('enroll', logger=self.logger)([
             Task('Start Guest Machines')(
-                VagrantUpActor(parent=self), guests, sequence
+                VagrantUpActor(parent=self), guests, sequence, skip_running=True
             ),
             Task('Enroll Machines')(
                 self.enroll, guests, unattended, argv
@@ -32,14 +32,20 @@ from commands.vagrant import (VagrantDestroyActor, VagrantHaltActor,
                               VagrantPruneActor, VagrantSSHActor,
                               VagrantUpActor, VagrantUpdateActor)
 from util.actor import TestSuiteActor
+from util.guestsync import synced_folders
 
 
 class TestCase(object):
     def __init__(
         self, actor, sssd_dir, artifacts_dir, case_dir, destroy_guests,
-        name, guests, tasks, artifacts, timeout
+        name, guests, tasks, artifacts, timeout, journal=None, key=None,
+        keep_running=False, resume_tasks=True
     ):
         self.actor = actor
+        self.keep_running = keep_running
+        self.journal = journal
+        self.key = key
+        self.resume_tasks = resume_tasks
         self.sssd_dir = sssd_dir
         self.artifacts_dir = artifacts_dir
         self.destroy_guests = destroy_guests
@@ -51,9 +57,25 @@ class TestCase(object):
         self.artifacts = artifacts
         self.timeout = timeout
 
+        # Some tasks of this test case have already finished.
+        key = self.get_task_key(0)
+        self.resumed = key is not None and journal.is_finished(key)
+
+    def checkpoint(self, key, handler, *args, record=True):
+        if key is None:
+            return lambda: handler(*args)
+
+        return self.journal.checkpoint(key, handler, *args, record=record)
+
+    def get_task_key(self, index):
+        if self.journal is None or not self.resume_tasks or not self.tasks:
+            return None
+
+        return self.journal.key(self.key, index, self.tasks[index])
+
     def get_tasks(self):
         case_tasks = []
-        for task in self.tasks:
+        for index, task in enumerate(self.tasks):
             artifacts = TestArtifacts(
                 self.actor,
                 self.case_dir,
@@ -63,7 +85,8 @@ class TestCase(object):
 
             case_tasks.append(Task(
                 name=task.get('name', None)
-            )(
+            )(self.checkpoint(
+                self.get_task_key(index),
                 TestCaseTask(
                     self.actor,
                     self.case_dir,
@@ -73,7 +96,7 @@ class TestCase(object):
                     task.get('directory', '/shared/sssd'),
                     task.get('timeout', None)
                 ).execute
-            ))
+            )))
 
         return case_tasks
 
@@ -86,8 +109,12 @@ class TestCase(object):
             cwd='/shared/sssd'
         )
 
+        # Rsync deletes files that are not present in the source directory,
+        # the source is not synchronized again when resuming a test case so
+        # files created by its finished tasks are kept.
         upshell = nutcli.shell.Shell(env={
-            'SSSD_TEST_SUITE_RSYNC': f'{self.sssd_dir}:/shared/sssd',
+            'SSSD_TEST_SUITE_RSYNC':
+                '' if self.resumed else f'{self.sssd_dir}:/shared/sssd',
             'SSSD_TEST_SUITE_SSHFS':
                 f'{self.artifacts_dir}:/shared/artifacts'
                 + f' {self.case_dir}:/shared/commands'
@@ -98,22 +125,26 @@ class TestCase(object):
             logger=self.actor.logger,
             timeout=self.timeout
         )([
+            # Do not destroy guests when resuming a partially finished case.
             Task(
                 name=f'Destroying guests: {self.guests}',
-                enabled=self.destroy_guests
-            )(
-                VagrantDestroyActor(parent=self.actor), self.guests
-            ),
+                enabled=self.destroy_guests and not self.keep_running
+            )(self.checkpoint(
+                self.get_task_key(0),
+                VagrantDestroyActor(parent=self.actor), self.guests,
+                record=False
+            )),
             Task(
                 name=f'Halting guests: {self.guests}',
-                enabled=not self.destroy_guests
+                enabled=not self.destroy_guests and not self.keep_running
             )(
                 VagrantHaltActor(parent=self.actor), self.guests
             ),
             Task(
                 name=f'Starting guests: {self.guests}'
             )(
-                VagrantUpActor(parent=self.actor, shell=upshell), self.guests
+                VagrantUpActor(parent=self.actor, shell=upshell), self.guests,
+                skip_running=self.keep_running
             ),
             *self.get_tasks(),
             Task(
@@ -124,10 +155,17 @@ class TestCase(object):
             ),
             Task(
                 name=f'Halting guests: {self.guests}',
+                enabled=not self.keep_running,
                 always=True
             )(
                 VagrantHaltActor(parent=self.actor), self.guests
             ),
+            Task(
+                name='Recording finished test case',
+                enabled=self.journal is not None
+            )(
+                lambda: self.journal.mark(self.key)
+            ),
         ])
 
 
@@ -286,19 +324,47 @@ class RunTestsActor(TestSuiteActor):
             help='Do not destroy existing machines.'
         )
 
+        parser.add_argument(
+            '-k', '--keep-running', action='store_true', dest='keep_running',
+            help='Do not destroy or halt guests between test cases.'
+        )
+
+        parser.add_argument(
+            '-r', '--resume', action='store_true', dest='resume',
+            help='Skip test cases and tasks that have finished in the last '
+                 'run of this command.'
+        )
+
         parser.epilog = textwrap.dedent('''
         This command will execute tests described in yaml configuration file.
         This file can be specified with --test-config parameter. If not set,
         $sssd/contrib/test-suite/test-suite.yml is used.
+
+        With --keep-running, guests are not destroyed or halted before and
+        after each test case. Only guests that are not running are started and
+        the SSSD source directory is synchronized to running guests only if it
+        has changed. Guests are left running when the tests are finished.
+
+        Finished test cases and tasks are recorded in a journal in the project
+        directory until all test cases pass. If the command fails, run it again
+        with --resume to skip test cases that have already finished. Tasks of
+        a partially finished test case that have already finished are skipped
+        as well, its guests are not destroyed and the SSSD source directory is
+        not synchronized to them again. Tasks are not skipped if the
+        configuration contains rsync folders since they would be synchronized.
         ''')
 
-    def __call__(self, sssd_dir, artifacts_dir, update, prune, suite, destroy):
+    def __call__(
+        self, sssd_dir, artifacts_dir, update, prune, suite, destroy,
+        resume=False, keep_running=False
+    ):
         suite = self.load_test_suite(suite, sssd_dir)
+        journal = self.get_journal('tests-run', resume)
 
-        required_guests = set()
-        for case in suite:
-            required_guests.update(case.get('machines', []))
-        required_guests = list(required_guests)
+        required_guests = self.get_required_guests(suite)
+        resume_tasks = not synced_folders(
+            self.get_config_file(), os.environ, 'rsync'
+        )
 
         tasks = TaskList('tesẗ́-suite', logger=self.logger)([
             TaskList(
@@ -310,19 +376,39 @@ class RunTestsActor(TestSuiteActor):
                     lambda: self.shell(['mkdir', '-p', artifacts_dir])
                 ),
                 Task('Destroying guests to allow update', enabled=update)(
-                    VagrantDestroyActor(parent=self), guests=required_guests
+                    journal.checkpoint(
+                        journal.key('update', required_guests),
+                        VagrantDestroyActor(parent=self),
+                        guests=required_guests, record=False
+                    )
                 ),
-                Task('Updating boxes', enabled=update)(
+                Task('Updating boxes', enabled=update)(journal.checkpoint(
+                    journal.key('update', required_guests),
                     VagrantUpdateActor(parent=self), guests=required_guests
-                ),
+                )),
                 Task('Removing outdated boxes', enabled=prune)(
-                    VagrantPruneActor(parent=self), force=True
+                    journal.checkpoint(
+                        journal.key('prune'),
+                        VagrantPruneActor(parent=self), force=True
+                    )
                 )
             ])
         ])
 
         with tempfile.TemporaryDirectory() as case_dir:
-            for case in suite:
+            for index, case in enumerate(suite):
+                key = journal.key(
+                    'case', index, case, os.path.abspath(sssd_dir),
+                    os.path.abspath(artifacts_dir), destroy
+                )
+
+                if journal.is_finished(key):
+                    self.info('Test case {} has already finished, skipping'.format(
+                        case.get('name', index)
+                    ))
+                    journal.skipped += 1
+                    continue
+
                 test_case = TestCase(
                     actor=self,
                     sssd_dir=sssd_dir,
@@ -333,15 +419,28 @@ class RunTestsActor(TestSuiteActor):
                     guests=case.get('machines', ['client']),
                     tasks=case.get('tasks', []),
                     artifacts=case.get('artifacts', []),
-                    timeout=case.get('timeout', None)
+                    timeout=case.get('timeout', None),
+                    journal=journal,
+                    key=key,
+                    keep_running=keep_running,
+                    resume_tasks=resume_tasks
                 )
 
                 tasks.append(test_case.get_tasklist())
 
+            tasks.append(Task('Removing journal')(self.finish_journal, journal))
             tasks.execute()
 
         return 0
 
+    def get_required_guests(self, suite):
+        required_guests = set()
+        for case in suite:
+            required_guests.update(case.get('machines', []))
+
+        # Sorted so the journal key is the same in every run.
+        return sorted(required_guests)
+
     def load_test_suite(self, config, sssd):
         if config is None:
             config = f'{sssd}/contrib/test-suite/test-suite.yml'
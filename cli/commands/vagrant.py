@@ -20,18 +20,67 @@
 #
 
 import argparse
+import json
 import os
 import re
+import subprocess
 import sys
+import textwrap
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import nutcli
 from nutcli.commands import Command
 from nutcli.parser import UniqueAppendAction
 
 from util.actor import TestSuiteActor
+from util.domains import GuestDomains, machine_id
+from util.guestsync import GuestStartState, synced_folders, tree_digest
+from util.image import format_size
+from util.pool import StoragePool
+from util.sshconfig import SSHConfigCache
+
+
+class GuestOutput(object):
+    """
+    Pipe that prints each line written into it prefixed with guest name so
+    output of vagrant processes that run in parallel can be told apart.
+    """
+
+    lock = threading.Lock()
+
+    def __init__(self, guest, width=0):
+        self.prefix = '[{}] '.format(guest.ljust(width))
+        self.read_fd = None
+        self.write_fd = None
+        self.thread = None
+
+    def __enter__(self):
+        (self.read_fd, self.write_fd) = os.pipe()
+        self.thread = threading.Thread(target=self._forward, daemon=True)
+        self.thread.start()
+        return self.write_fd
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        os.close(self.write_fd)
+        self.thread.join()
+
+    def _forward(self):
+        with open(self.read_fd, errors='replace') as f:
+            for line in f:
+                with self.lock:
+                    sys.stdout.write(self.prefix + line.rstrip('\n') + '\n')
+                    sys.stdout.flush()
 
 
 class VagrantCommandActor(TestSuiteActor):
+    # Command can be run for each guest in a separate vagrant process.
+    parallel = False
+
+    # Command starts or stops guests, cached SSH configuration is dropped.
+    changes_state = False
+
     def __init__(self, command, ok_rc=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.command = command
@@ -52,20 +101,23 @@ class VagrantCommandActor(TestSuiteActor):
             help='Run operation on guests in sequence (one by one)'
         )
 
+        if self.parallel:
+            parser.add_argument(
+                '-j', '--jobs', action='store', type=int, dest='jobs',
+                default=1,
+                help='Run operation in separate vagrant process for each '
+                     'guest, at most this number of guests at once (Default 1)'
+            )
+
         parser.add_argument(
             '--argv', dest='argv', nargs=argparse.REMAINDER, default=[],
             help='Additional arguments passed to the command'
         )
 
-    def _exec_vagrant(self, args=None, argv=None, **kwargs):
-        if self.cli_args.config is not None:
-            config = self.cli_args.config
-        else:
-            config = os.environ.get(
-               'SSSD_TEST_SUITE_CONFIG', self.vagrant_dir + '/config.json'
-            )
-
-        command = ['vagrant', *self.command.split(' '), *nutcli.utils.get_as_list(args)]
+    def _exec_vagrant(self, args=None, argv=None, command=None, **kwargs):
+        config = self.get_config_file()
+        command = command if command is not None else self.command
+        command = ['vagrant', *command.split(' '), *nutcli.utils.get_as_list(args)]
         if argv is not None:
             command += ['--'] + argv
 
@@ -78,7 +130,7 @@ class VagrantCommandActor(TestSuiteActor):
             **kwargs
         )
 
-    def __call__(self, guests, sequence=False, argv=None):
+    def __call__(self, guests, sequence=False, argv=None, jobs=1):
         argv = nutcli.utils.get_as_list(argv)
 
         def run_guest(guests, argv):
@@ -91,51 +143,356 @@ class VagrantCommandActor(TestSuiteActor):
         guests = guests if 'all' not in guests else self.AllGuests
         guests.sort()
 
-        if sequence:
+        if self.changes_state:
+            self.forget_guests(guests)
+
+        if jobs > 1 and len(guests) > 1:
+            self.run_parallel(guests, argv, jobs)
+        elif sequence:
             for guest in guests:
                 run_guest([guest], argv)
         else:
             run_guest(guests, argv)
 
+    def get_ssh_config(self, guest):
+        """
+        Return path to SSH configuration of the guest, 'vagrant ssh-config'
+        is called only if it is not cached yet. None is returned if the guest
+        can not be reached over SSH.
+        """
+        cache = SSHConfigCache(self.vagrant_dir)
+        path = cache.lookup(guest)
+        if path is not None:
+            return path
+
+        try:
+            result = self._exec_vagrant(
+                [guest], command='ssh-config', capture_output=True,
+                effect=nutcli.shell.Shell.Effect.LogExecution
+            )
+        except nutcli.shell.ShellCommandError:
+            return None
+
+        return cache.store(guest, result.stdout)
+
+    def forget_guests(self, guests):
+        """
+        Drop cached information about guests whose state is going to change.
+        """
+        # Address of the guest may change when it is started again.
+        cache = SSHConfigCache(self.vagrant_dir)
+        for guest in guests:
+            if not os.path.exists(cache.path(guest)):
+                continue
+
+            self.shell(cache.control_command(guest), check=False, capture_output=True)
+            cache.invalidate(guest)
+
+        state = self.get_start_state()
+        if any(guest in state.entries for guest in guests):
+            state.forget(guests)
+            self.save_start_state(state)
+
+    def get_start_state(self):
+        return GuestStartState(f'{self.vagrant_dir}/.vagrant/start-state.json').load()
+
+    @nutcli.decorators.SideEffect()
+    def save_start_state(self, state):
+        state.save()
+
+    def run_parallel(self, guests, argv, jobs):
+        width = max(len(guest) for guest in guests)
+        results = {}
+
+        def run_guest(guest):
+            start = time.monotonic()
+            error = None
+            with GuestOutput(guest, width) as output:
+                try:
+                    self._exec_vagrant(
+                        argv + [guest], stdout=output, stderr=subprocess.STDOUT
+                    )
+                except nutcli.shell.ShellCommandError as err:
+                    if err.rc not in self.ok_rc:
+                        error = f'exit code {err.rc}'
+                except Exception as err:
+                    error = str(err)
+
+            results[guest] = (error, time.monotonic() - start)
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            list(executor.map(run_guest, guests))
+
+        line = '{:10s} {:>10s}  {}'
+        self.info(line.format('guest', 'duration', 'result'))
+        for guest in guests:
+            (error, duration) = results[guest]
+            self.info(line.format(
+                guest, f'{duration:.1f}s', 'ok' if error is None else error
+            ))
+
+        failed = [guest for guest in guests if results[guest][0] is not None]
+        if failed:
+            raise RuntimeError('vagrant {} failed for: {}'.format(
+                self.command, ', '.join(failed)
+            ))
+
 
 class VagrantStatusActor(VagrantCommandActor):
     def __init__(self, *args, **kwargs):
         super().__init__('status', None, *args, **kwargs)
 
+    def setup_parser(self, parser):
+        super().setup_parser(parser)
+
+        parser.add_argument(
+            '-b', '--backend', action='store', type=str, dest='backend',
+            choices=['auto', 'libvirt', 'vagrant'], default='auto',
+            help='How to obtain the state of guests (Default "auto")'
+        )
+
+        parser.add_argument(
+            '--uri', action='store', type=str, dest='uri',
+            default='qemu:///system',
+            help='Libvirt connection URI (Default "qemu:///system")'
+        )
+
+        parser.add_argument(
+            '--json', action='store_true', dest='json_output',
+            help='Print state of guests in JSON format'
+        )
+
+        parser.epilog = textwrap.dedent('''
+        With --backend=libvirt, the state of guests is read directly from
+        libvirt. Each guest is mapped to its domain by the machine id that is
+        stored in .vagrant/machines/$guest/libvirt/id, therefore vagrant is
+        not started at all. This requires Python bindings for libvirt
+        (python3-libvirt). With --backend=vagrant, the output of
+        'vagrant status' is used. The default is to use libvirt if the
+        bindings are available and no additional arguments are given.
+        ''')
+
+    def __call__(
+        self, guests, sequence=False, argv=None, backend='auto',
+        uri='qemu:///system', json_output=False
+    ):
+        guests = sorted(guests if 'all' not in guests else self.AllGuests)
+
+        if backend == 'auto':
+            use_libvirt = GuestDomains.available() and not argv
+            backend = 'libvirt' if use_libvirt else 'vagrant'
+
+        if backend == 'libvirt':
+            status = self.get_libvirt_status(guests, uri)
+        elif json_output:
+            status = self.get_vagrant_status(guests)
+        else:
+            return super().__call__(guests, sequence, argv)
+
+        if json_output:
+            print(json.dumps(status, indent=2))
+            return
+
+        for guest, info in status.items():
+            print('{:12s} {:15s} {}'.format(
+                guest,
+                info['state'].replace('_', ' '),
+                info['domain'] if info['domain'] is not None else ''
+            ).rstrip())
+
+    def get_libvirt_status(self, guests, uri):
+        connection = GuestDomains.connect(uri)
+        try:
+            return GuestDomains(self.vagrant_dir, connection).status(guests)
+        finally:
+            connection.close()
+
+    def get_vagrant_status(self, guests):
+        result = self._exec_vagrant(
+            ['--machine-readable', *guests], capture_output=True,
+            effect=nutcli.shell.Shell.Effect.LogExecution
+        )
+
+        status = {
+            guest: {'state': 'unknown', 'domain': None, 'id': None}
+            for guest in guests
+        }
+
+        # Format: timestamp,target,type,data
+        for line in result.stdout.splitlines():
+            fields = line.split(',', 3)
+            if len(fields) == 4 and fields[2] == 'state' and fields[1] in status:
+                status[fields[1]]['state'] = fields[3]
+
+        return status
+
 
 class VagrantUpActor(VagrantCommandActor):
+    parallel = True
+    changes_state = True
+
     def __init__(self, *args, **kwargs):
         super().__init__('up', None, *args, **kwargs)
 
+    def setup_parser(self, parser):
+        super().setup_parser(parser)
+
+        parser.add_argument(
+            '--skip-running', action='store_true', dest='skip_running',
+            help='Start only guests that are not running, sync folders of '
+                 'running guests only if they have changed'
+        )
+
+    def __call__(self, guests, sequence=False, argv=None, jobs=1, skip_running=False):
+        if not skip_running:
+            return super().__call__(guests, sequence, argv, jobs)
+
+        guests = sorted(guests if 'all' not in guests else self.AllGuests)
+
+        start = time.monotonic()
+        states = self.get_guest_states(guests)
+        env = self.shell.env.get()
+        config = self.get_config_file()
+        mounts = {
+            kind: synced_folders(config, env, kind) for kind in ['sshfs', 'nfs']
+        }
+        rsync = synced_folders(config, env, 'rsync')
+        digests = {host: tree_digest(host) for host in rsync}
+        checked = time.monotonic() - start
+
+        state = self.get_start_state()
+        entries = {
+            guest: state.get(guest, machine_id(self.vagrant_dir, guest))
+            for guest in guests
+        }
+
+        plan = {}
+        for guest in guests:
+            entry = entries[guest]
+            if states[guest] != 'running':
+                plan[guest] = 'start'
+            elif guest in self.WindowsGuests:
+                plan[guest] = 'skip'
+            elif entry is None:
+                # Guest was started by plain vagrant up, only folders from
+                # configuration are mounted.
+                mounted = env.get('SSSD_TEST_SUITE_SSHFS') or env.get('SSSD_TEST_SUITE_NFS')
+                plan[guest] = 'reload' if mounted else ('sync' if rsync else 'skip')
+            elif entry.get('mounts') != mounts:
+                plan[guest] = 'reload'
+            elif entry.get('rsync') != digests:
+                plan[guest] = 'sync'
+            else:
+                plan[guest] = 'skip'
+
+        durations = {}
+
+        def run(action, handler, key):
+            selected = [guest for guest in guests if plan[guest] == action]
+            if not selected:
+                return
+
+            begin = time.monotonic()
+            handler(selected)
+            duration = time.monotonic() - begin
+
+            for guest in selected:
+                durations[guest] = duration
+                state.record(
+                    guest, machine_id(self.vagrant_dir, guest),
+                    mounts=mounts, rsync=digests, **{key: duration}
+                )
+
+            self.save_start_state(state)
+
+        up = super().__call__
+        reload = VagrantReloadActor(parent=self)
+
+        run('start', lambda selected: up(selected, sequence, argv, jobs), 'boot')
+        run('reload', lambda selected: reload(selected, sequence, None, jobs), 'boot')
+        run('sync', lambda selected: self._exec_vagrant(selected, command='rsync'), 'sync')
+
+        self.report_skipped(guests, plan, entries, durations, checked, bool(rsync))
+
+    def get_guest_states(self, guests):
+        status = VagrantStatusActor(parent=self)
+        if GuestDomains.available():
+            result = status.get_libvirt_status(guests, 'qemu:///system')
+        else:
+            result = status.get_vagrant_status(guests)
+
+        return {guest: info['state'] for guest, info in result.items()}
+
+    def report_skipped(self, guests, plan, entries, durations, checked, rsync):
+        actions = {
+            'start': 'started', 'reload': 'reloaded', 'sync': 'synced',
+            'skip': 'skipped',
+        }
+
+        line = '{:10s} {:10s} {:>10s}'
+        self.info(line.format('guest', 'action', 'duration'))
+        for guest in guests:
+            duration = durations.get(guest)
+            self.info(line.format(
+                guest, actions[plan[guest]],
+                f'{duration:.1f}s' if duration is not None else '-'
+            ))
+
+        # Estimate saved time from previous starts and syncs of the guests.
+        boots = [guest for guest in guests if plan[guest] in ['sync', 'skip']]
+        syncs = [guest for guest in guests if plan[guest] == 'skip' and rsync]
+        saved = sum((entries[guest] or {}).get('boot', 0) for guest in boots)
+        saved += sum((entries[guest] or {}).get('sync', 0) for guest in syncs)
+
+        self.info(
+            f'Skipped {len(boots)} guest starts and {len(syncs)} folder syncs, '
+            f'about {saved:.1f}s saved. Checking state and folders took {checked:.1f}s.'
+        )
+
 
 class VagrantHaltActor(VagrantCommandActor):
+    parallel = True
+    changes_state = True
+
     def __init__(self, *args, **kwargs):
         super().__init__('halt', None, *args, **kwargs)
 
 
 class VagrantDestroyActor(VagrantCommandActor):
+    parallel = True
+    changes_state = True
+
     def __init__(self, *args, **kwargs):
         super().__init__('destroy', [2], *args, **kwargs)
 
-    def __call__(self, guests, sequence=False, argv=None):
+    def __call__(self, guests, sequence=False, argv=None, jobs=1):
         argv = nutcli.utils.get_as_list(argv)
         if '-f' not in argv:
             argv.append('-f')
 
-        super().__call__(guests, sequence, argv)
+        super().__call__(guests, sequence, argv, jobs)
 
 
 class VagrantReloadActor(VagrantCommandActor):
+    parallel = True
+    changes_state = True
+
     def __init__(self, *args, **kwargs):
         super().__init__('reload', None, *args, **kwargs)
 
 
 class VagrantResumeActor(VagrantCommandActor):
+    parallel = True
+    changes_state = True
+
     def __init__(self, *args, **kwargs):
         super().__init__('resume', None, *args, **kwargs)
 
 
 class VagrantSuspendActor(VagrantCommandActor):
+    parallel = True
+    changes_state = True
+
     def __init__(self, *args, **kwargs):
         super().__init__('suspend', None, *args, **kwargs)
 
@@ -168,39 +525,102 @@ class VagrantPruneActor(VagrantCommandActor):
             help='Destroy without confirmation even when box is in use'
         )
 
+        parser.add_argument(
+            '-n', '--dry-run', action='store_true', dest='dry_run',
+            help='Only print boxes and volumes that would be removed'
+        )
+
+        parser.add_argument(
+            '-j', '--jobs', action='store', type=int, dest='jobs',
+            default=4, help='Number of parallel virsh processes that '
+            'delete volumes (Default 4)'
+        )
+
         parser.add_argument(
             '--argv', dest='argv', nargs=argparse.REMAINDER, default=[],
             help='Additional arguments passed to the command'
         )
 
-    def __call__(self, force, argv=None):
-        regex = re.compile(
+    def __call__(self, force, argv=None, dry_run=False, jobs=4):
+        removed = re.compile(
             r"^[^']+'([^']+)' \(v([^)]+)\).*$",
             re.MULTILINE
         )
 
+        would_remove = re.compile(
+            r'^Would remove (\S+) \S+ (\S+)$',
+            re.MULTILINE
+        )
+
         args = nutcli.utils.get_as_list(argv)
         if force:
             args.append('--force')
 
-        result = self._exec_vagrant(args=args, argv=None, capture_output=True)
-        for (box, version) in regex.findall(result.stdout):
-            volume = '{box}_vagrant_box_image_{version}.img'.format(
-                box=box.replace('/', '-VAGRANTSLASH-'),
-                version=version
-            )
+        if dry_run:
+            args.append('--dry-run')
+
+        result = self._exec_vagrant(
+            args=args, argv=None, capture_output=True,
+            effect=nutcli.shell.Shell.Effect.LogExecution if dry_run else None
+        )
+
+        output = result.stdout if result.stdout else ''
+        boxes = sorted(set(removed.findall(output) + would_remove.findall(output)))
+        if not boxes:
+            return
+
+        pool = StoragePool()
+        volumes = pool.parse(self.shell(
+            ['sudo', *pool.list_command()], capture_output=True,
+            effect=nutcli.shell.Shell.Effect.LogExecution
+        ).stdout)
 
+        stale = {}
+        for (box, version) in boxes:
+            volume = pool.box_volume(box, version)
             self.info(f'Box {box}, version {version} is outdated.')
-            self.info(f'  ...removing {volume}')
+            if volume not in volumes:
+                continue
+
+            stale[volume] = volumes[volume]
+            self.info('  ...{} {} ({})'.format(
+                'would remove' if dry_run else 'removing',
+                volume, format_size(volumes[volume])
+            ))
+
+        if dry_run:
+            self.info('{} volumes would be removed, {} would be reclaimed.'.format(
+                len(stale), format_size(sum(stale.values()))
+            ))
+            return
+
+        failed = []
+
+        def delete(command):
+            try:
+                self.shell(['sudo', *command])
+            except nutcli.shell.ShellCommandError:
+                failed.append(command)
 
-            self.shell('''
-            sudo virsh vol-info {volume} --pool {pool} &> /dev/null
-            if [ $? -ne 0 ]; then
-                exit 0
-            fi
+        with ThreadPoolExecutor(max_workers=max(jobs, 1)) as executor:
+            list(executor.map(delete, pool.delete_commands(stale, max(jobs, 1))))
 
-            sudo virsh vol-delete {volume} --pool {pool}
-            '''.format(volume=volume, pool='sssd-test-suite'))
+        remaining = set()
+        if failed:
+            remaining = set(stale) & set(pool.parse(self.shell(
+                ['sudo', *pool.list_command()], capture_output=True,
+                effect=nutcli.shell.Shell.Effect.LogExecution
+            ).stdout))
+
+        self.info('Removed {} volumes, reclaimed {}.'.format(
+            len(stale) - len(remaining),
+            format_size(sum(stale[x] for x in stale if x not in remaining))
+        ))
+
+        if remaining:
+            raise RuntimeError('Unable to remove volumes: {}'.format(
+                ', '.join(sorted(remaining))
+            ))
 
 
 class VagrantSSHActor(VagrantCommandActor):
@@ -212,13 +632,30 @@ class VagrantSSHActor(VagrantCommandActor):
             'guest', type=str, choices=self.LinuxGuests
         )
 
+        parser.add_argument(
+            '--vagrant', action='store_true', dest='use_vagrant',
+            help='Connect with vagrant ssh instead of running ssh directly'
+        )
+
         parser.add_argument(
             'argv', nargs=argparse.REMAINDER,
             help='Additional arguments passed to the SSH client'
         )
 
-    def __call__(self, guest, argv):
-        self._exec_vagrant([guest], argv)
+        parser.epilog = textwrap.dedent('''
+        The output of 'vagrant ssh-config' is cached for each guest in
+        .vagrant/ssh-config and ssh is run directly with connection
+        multiplexing, so vagrant is not started for each connection. The
+        cache is dropped when the guest is started, halted or recreated.
+        ''')
+
+    def __call__(self, guest, argv, use_vagrant=False):
+        config = None if use_vagrant else self.get_ssh_config(guest)
+        if config is None:
+            self._exec_vagrant([guest], argv)
+            return
+
+        self.shell(SSHConfigCache(self.vagrant_dir).ssh_command(guest, argv))
 
 
 class VagrantRDPActor(VagrantCommandActor):
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+#
+#    Authors:
+#        Pavel Březina <pbrezina@redhat.com>
+#
+#    Copyright (C) 2019 Red Hat
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import os
+import subprocess
+import sys
+
+CLI_DIR = os.path.abspath(os.path.dirname(os.path.realpath(__file__)) + '/..')
+
+UPDATE_KEY = '''
+from commands.tests import RunTestsActor
+from util.journal import TaskJournal
+
+suite = [
+    {'machines': ['ipa', 'client']},
+    {'machines': ['ldap', 'samba', 'ad', 'ad-child']},
+]
+
+journal = TaskJournal('/nonexistent/journal.json', resume=True)
+print(journal.key('update', RunTestsActor().get_required_guests(suite)))
+'''
+
+
+def update_key(seed):
+    env = dict(os.environ, PYTHONHASHSEED=str(seed), PYTHONPATH=CLI_DIR)
+    result = subprocess.run(
+        [sys.executable, '-c', UPDATE_KEY], env=env, cwd=CLI_DIR, check=True,
+        stdout=subprocess.PIPE, universal_newlines=True
+    )
+
+    return result.stdout.strip()
+
+
+def test_update_key_does_not_depend_on_hash_seed():
+    keys = {update_key(seed) for seed in range(1, 6)}
+    assert len(keys) == 1
@@ -23,6 +23,8 @@ import os
 
 import nutcli
 
+from util.journal import TaskJournal
+
 
 class TestSuiteActor(nutcli.commands.Actor):
     LinuxGuests = ['ipa', 'ldap', 'client']
@@ -41,3 +43,20 @@ class TestSuiteActor(nutcli.commands.Actor):
         )
 
         self.vagrant_dir = self.project_dir
+
+    def get_config_file(self):
+        if self.cli_args.config is not None:
+            return self.cli_args.config
+
+        return os.environ.get(
+            'SSSD_TEST_SUITE_CONFIG', self.vagrant_dir + '/config.json'
+        )
+
+    def get_journal(self, name, resume=False):
+        return TaskJournal(f'{self.project_dir}/.journal/{name}.json', resume)
+
+    def finish_journal(self, journal):
+        if journal.skipped:
+            self.info(f'Resumed: {journal.skipped} finished tasks were skipped')
+
+        journal.remove()
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+#
+#    Authors:
+#        Pavel Březina <pbrezina@redhat.com>
+#
+#    Copyright (C) 2019 Red Hat
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import gzip
+import hashlib
+import io
+import json
+import math
+import os
+import tarfile
+import tempfile
+import time
+
+
+class HashingWriter:
+    """
+    Write-only file object that computes digest of written data.
+    """
+
+    def __init__(self, fileobj, algorithm='sha256'):
+        self.fileobj = fileobj
+        self.hash = hashlib.new(algorithm)
+        self.size = 0
+
+    def write(self, data):
+        self.hash.update(data)
+        self.size += len(data)
+        return self.fileobj.write(data)
+
+    def hexdigest(self):
+        return self.hash.hexdigest()
+
+
+class BoxArchive:
+    """
+    Vagrant box for libvirt provider with the same layout as produced by
+    vagrant package: metadata.json, Vagrantfile and box.img.
+    """
+
+    def __init__(self, image, vagrantfile, virtual_size, compress_level=6, block_size=1024 * 1024):
+        self.image = image
+        self.vagrantfile = vagrantfile
+        self.virtual_size = virtual_size
+        self.compress_level = compress_level
+        self.block_size = block_size
+
+    def metadata(self):
+        return json.dumps({
+            'provider': 'libvirt',
+            'format': 'qcow2',
+            'virtual_size': math.ceil(self.virtual_size / 1024 ** 3)
+        })
+
+    def write(self, path):
+        """
+        Stream the box into a temporary file in the destination directory
+        and rename it to ``path``. Returns sha256 checksum of the box.
+        """
+        (fd, tmp) = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(path)),
+            prefix=f'.{os.path.basename(path)}.'
+        )
+
+        try:
+            with os.fdopen(fd, 'wb', buffering=self.block_size) as f:
+                writer = HashingWriter(f)
+                self._write_tar(writer)
+
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+        return writer.hexdigest()
+
+    def _write_tar(self, fileobj):
+        if self.compress_level > 0:
+            with gzip.GzipFile(
+                filename='', mode='wb', fileobj=fileobj,
+                compresslevel=self.compress_level
+            ) as gz:
+                self._write_members(gz)
+        else:
+            self._write_members(fileobj)
+
+    def _write_members(self, fileobj):
+        with tarfile.open(
+            fileobj=fileobj, mode='w|',
+            bufsize=self.block_size, copybufsize=self.block_size
+        ) as tar:
+            self._add_bytes(tar, 'metadata.json', self.metadata().encode('utf-8'))
+            with open(self.vagrantfile, 'rb') as f:
+                self._add_bytes(tar, 'Vagrantfile', f.read())
+
+            info = tar.gettarinfo(self.image, arcname='box.img')
+            info.uid = info.gid = 0
+            info.uname = info.gname = 'root'
+            info.mode = 0o644
+            with open(self.image, 'rb') as f:
+                tar.addfile(info, f)
+
+    def _add_bytes(self, tar, name, content):
+        info = tarfile.TarInfo(name)
+        info.size = len(content)
+        info.mode = 0o644
+        info.mtime = int(time.time())
+        tar.addfile(info, io.BytesIO(content))
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+#
+#    Authors:
+#        Pavel Březina <pbrezina@redhat.com>
+#
+#    Copyright (C) 2019 Red Hat
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import hashlib
+import json
+import mmap
+import os
+import queue
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Checksum:
+    """
+    Compute several digests of a file in a single pass.
+
+    With the ``read`` method, a background thread reads large blocks while
+    the previous block is being hashed. With ``mmap``, the file is mapped
+    into memory and the kernel read-ahead provides the overlap. Hashlib
+    releases the GIL on large buffers, so each digest is updated in its own
+    thread when more than one digest is requested. This only helps with
+    several CPUs, otherwise the total time is the sum of all digests.
+    """
+
+    Algorithms = ['md5', 'sha1', 'sha256', 'sha384', 'sha512']
+    Methods = ['read', 'mmap']
+
+    def __init__(self, algorithms=None, method='read', block_size=8 * 1024 * 1024, queue_size=4):
+        self.algorithms = algorithms if algorithms else ['sha256']
+        self.method = method
+        self.block_size = block_size
+        self.queue_size = queue_size
+
+        for algorithm in self.algorithms:
+            if algorithm not in self.Algorithms:
+                raise ValueError(f'Unsupported checksum algorithm: {algorithm}')
+
+        if method not in self.Methods:
+            raise ValueError(f'Unsupported read method: {method}')
+
+    def compute(self, path):
+        hashes = [hashlib.new(algorithm) for algorithm in self.algorithms]
+
+        if len(hashes) == 1:
+            self._hash(path, hashes[0].update)
+        else:
+            with ThreadPoolExecutor(max_workers=len(hashes)) as executor:
+                def update(block):
+                    list(executor.map(lambda h: h.update(block), hashes))
+
+                self._hash(path, update)
+
+        return {
+            algorithm: h.hexdigest() for algorithm, h in zip(self.algorithms, hashes)
+        }
+
+    def _hash(self, path, update):
+        if self.method == 'mmap' and os.path.getsize(path) > 0:
+            self._hash_mmap(path, update)
+            return
+
+        for block in self._read_blocks(path):
+            update(block)
+
+    def _hash_mmap(self, path, update):
+        with open(path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                if hasattr(m, 'madvise'):
+                    m.madvise(mmap.MADV_SEQUENTIAL)
+
+                with memoryview(m) as view:
+                    for offset in range(0, len(view), self.block_size):
+                        with view[offset:offset + self.block_size] as block:
+                            update(block)
+
+    def _read_blocks(self, path):
+        blocks = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        error = []
+
+        def reader():
+            try:
+                with open(path, 'rb', buffering=0) as f:
+                    while not stop.is_set():
+                        block = f.read(self.block_size)
+                        blocks.put(block)
+                        if not block:
+                            return
+            except Exception as e:
+                error.append(e)
+                blocks.put(b'')
+
+        thread = threading.Thread(target=reader, daemon=True)
+        thread.start()
+
+        try:
+            while True:
+                block = blocks.get()
+                if not block:
+                    break
+
+                yield block
+        finally:
+            stop.set()
+            while thread.is_alive():
+                try:
+                    blocks.get_nowait()
+                except queue.Empty:
+                    thread.join(0.01)
+
+        if error:
+            raise error[0]
+
+
+class ChecksumCache:
+    """
+    Persistent cache of file checksums. An entry is valid only while the
+    file keeps the same inode, size and modification time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.changes = {}
+
+    def load(self):
+        self.entries = self._read()
+        return self
+
+    def save(self):
+        with self.lock:
+            if not self.changes:
+                return
+
+            # Merge with entries written by other processes in the meantime.
+            entries = self._read()
+            entries.update(self.changes)
+            entries = {
+                path: entry for path, entry in entries.items()
+                if os.path.exists(path)
+            }
+
+            (fd, tmp) = tempfile.mkstemp(
+                dir=os.path.dirname(self.path),
+                prefix=f'.{os.path.basename(self.path)}.'
+            )
+
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(entries, f)
+
+                os.replace(tmp, self.path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+
+            self.entries = entries
+            self.changes = {}
+
+    def key(self, path):
+        return os.path.realpath(path)
+
+    def signature(self, stat):
+        return {
+            'inode': stat.st_ino,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+        }
+
+    def lookup(self, path, algorithms):
+        signature = self.signature(os.stat(path))
+        with self.lock:
+            entry = self.entries.get(self.key(path))
+
+        if entry is None or entry['signature'] != signature:
+            return None
+
+        if any(algorithm not in entry['checksums'] for algorithm in algorithms):
+            return None
+
+        return {algorithm: entry['checksums'][algorithm] for algorithm in algorithms}
+
+    def store(self, path, checksums, stat):
+        """
+        Store checksums computed from file that had ``stat`` before it was
+        read. Nothing is stored if the file has changed since then.
+        """
+        signature = self.signature(stat)
+        if self.signature(os.stat(path)) != signature:
+            return
+
+        key = self.key(path)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry['signature'] != signature:
+                entry = {'signature': signature, 'checksums': {}}
+
+            entry = {
+                'signature': signature,
+                'checksums': {**entry['checksums'], **checksums}
+            }
+
+            self.entries[key] = entry
+            self.changes[key] = entry
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
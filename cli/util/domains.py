@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+#
+#    Authors:
+#        Pavel Březina <pbrezina@redhat.com>
+#
+#    Copyright (C) 2019 Red Hat
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+try:
+    import libvirt
+except ImportError:
+    libvirt = None
+
+
+def machine_id(vagrant_dir, guest):
+    """
+    Return id of the libvirt domain that vagrant created for ``guest`` or
+    None if the guest has not been created.
+    """
+    path = f'{vagrant_dir}/.vagrant/machines/{guest}/libvirt/id'
+    try:
+        with open(path) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+class GuestDomains:
+    """
+    Read state of guests directly from libvirt. Each guest is mapped to its
+    domain through the machine id stored by vagrant-libvirt, therefore
+    vagrant itself does not have to be started.
+    """
+
+    # Domain states as reported by vagrant-libvirt, indexed by virDomainState.
+    States = [
+        'nostate', 'running', 'blocked', 'paused', 'shutting-down', 'shutoff',
+        'crashed', 'pmsuspended'
+    ]
+
+    NotCreated = 'not_created'
+
+    def __init__(self, vagrant_dir, connection):
+        self.vagrant_dir = vagrant_dir
+        self.connection = connection
+
+    @staticmethod
+    def available():
+        return libvirt is not None
+
+    @staticmethod
+    def connect(uri='qemu:///system'):
+        if libvirt is None:
+            raise RuntimeError('Python bindings for libvirt are not installed')
+
+        return libvirt.openReadOnly(uri)
+
+    def state(self, domain):
+        (state, _) = domain.state()
+        if 0 <= state < len(self.States):
+            return self.States[state]
+
+        return 'unknown'
+
+    def status(self, guests):
+        ids = {guest: machine_id(self.vagrant_dir, guest) for guest in guests}
+
+        domains = {}
+        if any(ids.values()):
+            domains = {
+                domain.UUIDString(): domain
+                for domain in self.connection.listAllDomains()
+            }
+
+        status = {}
+        for guest in guests:
+            domain = domains.get(ids[guest])
+            if domain is None:
+                status[guest] = {
+                    'state': self.NotCreated,
+                    'domain': None,
+                    'id': ids[guest],
+                }
+                continue
+
+            status[guest] = {
+                'state': self.state(domain),
+                'domain': domain.name(),
+                'id': ids[guest],
+            }
+
+        return status
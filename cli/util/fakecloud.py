@@ -0,0 +1,491 @@
+# -*- coding: utf-8 -*-
+#
+#    Authors:
+#        Pavel Březina <pbrezina@redhat.com>
+#
+#    Copyright (C) 2019 Red Hat
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import hashlib
+import json
+import random
+import re
+import socket
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from requests_toolbelt import MultipartDecoder
+
+
+class FakeVagrantCloudHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.server.cloud.dispatch(self, 'GET')
+
+    def do_POST(self):
+        self.server.cloud.dispatch(self, 'POST')
+
+    def do_PUT(self):
+        self.server.cloud.dispatch(self, 'PUT')
+
+    def do_HEAD(self):
+        self.server.cloud.dispatch(self, 'HEAD')
+
+    def do_DELETE(self):
+        self.server.cloud.dispatch(self, 'DELETE')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeVagrantCloud:
+    """
+    Local in-memory stand-in for the Vagrant Cloud API used by VagrantCloud.
+
+    Failures can be injected with :func:`inject_failure` to simulate server
+    errors and connections that are reset in the middle of a request.
+    Each request can be delayed by ``latency`` seconds and a random
+    ``error_rate`` fraction of requests is answered with 503. If
+    ``ranged_upload`` is false, Content-Range of uploaded chunks is ignored
+    and each chunk replaces the whole artifact like in Vagrant Cloud.
+    """
+
+    class Failure:
+        def __init__(self, method, path, status, after_bytes, count):
+            self.method = method
+            self.path = re.compile(path)
+            self.status = status
+            self.after_bytes = after_bytes
+            self.count = count
+
+    def __init__(
+        self, username='sssd', host='127.0.0.1', port=0, page_limit=100,
+        latency=0.0, error_rate=0.0, seed=None, ranged_upload=True
+    ):
+        self.username = username
+        self.ranged_upload = ranged_upload
+        self.page_limit = page_limit
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.boxes = {}
+        self.uploads = {}
+        self.failures = []
+        self.requests = 0
+
+        self.server = ThreadingHTTPServer((host, port), FakeVagrantCloudHandler)
+        self.server.daemon_threads = True
+        self.server.cloud = self
+        self.thread = None
+
+        prefix = r'^/api/v1/box/(?P<username>[^/]+)/(?P<boxname>[^/?]+)'
+        version = prefix + r'/version/(?P<version>[^/?]+)'
+        provider = version + r'/provider/(?P<provider>[^/?]+)'
+
+        self.routes = [
+            ('GET', r'^/api/v1/search', self.search),
+            ('POST', r'^/api/v1/boxes$', self.box_create),
+            ('GET', prefix + r'$', self.box_get),
+            ('PUT', prefix + r'$', self.box_update),
+            ('POST', prefix + r'/versions$', self.version_create),
+            ('GET', version + r'$', self.version_get),
+            ('PUT', version + r'$', self.version_update),
+            ('DELETE', version + r'$', self.version_delete),
+            ('PUT', version + r'/release$', self.version_release),
+            ('POST', version + r'/providers$', self.provider_create),
+            ('GET', provider + r'$', self.provider_get),
+            ('PUT', provider + r'$', self.provider_update),
+            ('GET', provider + r'/upload$', self.provider_upload_path),
+            ('PUT', r'^/upload/(?P<token>[^/?]+)$', self.upload),
+            ('HEAD', r'^/download/(?P<boxname>[^/]+)/(?P<version>[^/]+)'
+                     r'/(?P<provider>[^/?]+)$', self.download),
+        ]
+
+    @property
+    def root(self):
+        (host, port) = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    @property
+    def url(self):
+        return f'{self.root}/api/v1'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def inject_failure(self, method, path, status=503, after_bytes=None, count=1):
+        """
+        Make next ``count`` requests matching ``method`` and ``path`` regular
+        expression fail. If ``status`` is ``None`` the connection is reset
+        after ``after_bytes`` of the request body are received.
+        """
+        with self.lock:
+            self.failures.append(
+                self.Failure(method, path, status, after_bytes, count)
+            )
+
+    def populate(self, count, versions=3, prefix='box'):
+        for i in range(count):
+            self.add_box(
+                f'{prefix}{i:05d}', [f'{v + 1:02d}' for v in range(versions)]
+            )
+
+    def add_box(self, name, versions=None, released=True):
+        with self.lock:
+            box = self._new_box(self.username, name)
+            for version in versions if versions is not None else []:
+                box['versions'][version] = self._new_version(version)
+                if released:
+                    box['versions'][version]['status'] = 'active'
+
+    def get_upload(self, name, version, provider):
+        box = self.boxes[name]
+        return bytes(box['versions'][version]['providers'][provider]['data'])
+
+    def dispatch(self, handler, method):
+        with self.lock:
+            self.requests += 1
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        path = handler.path.split('?')[0]
+        failure = self._match_failure(method, path)
+        if failure is not None:
+            self._fail(handler, failure)
+            return
+
+        # Read the body outside of the lock so uploads can run in parallel.
+        length = int(handler.headers.get('Content-Length', 0))
+        handler.body = handler.rfile.read(length) if length else b''
+
+        for (route_method, pattern, callback) in self.routes:
+            if route_method != method:
+                continue
+
+            match = re.match(pattern, path)
+            if match is None:
+                continue
+
+            with self.lock:
+                (status, data) = callback(handler, **match.groupdict())
+
+            self._reply(handler, status, data)
+            return
+
+        self._reply(handler, 404, {'errors': [f'No route for {method} {path}']})
+
+    def _match_failure(self, method, path):
+        with self.lock:
+            if self.error_rate and self.random.random() < self.error_rate:
+                return self.Failure(method, path, 503, None, 1)
+
+            for failure in self.failures:
+                if failure.method == method and failure.path.search(path):
+                    failure.count -= 1
+                    if failure.count <= 0:
+                        self.failures.remove(failure)
+                    return failure
+
+        return None
+
+    def _fail(self, handler, failure):
+        if failure.status is not None:
+            length = int(handler.headers.get('Content-Length', 0))
+            handler.rfile.read(length)
+            self._reply(handler, failure.status, {
+                'errors': ['Injected failure']
+            })
+            return
+
+        length = int(handler.headers.get('Content-Length', 0))
+        handler.rfile.read(min(failure.after_bytes or 0, length))
+        handler.close_connection = True
+        handler.connection.shutdown(socket.SHUT_RDWR)
+
+    def _read_body(self, handler):
+        return handler.body
+
+    def _read_json(self, handler):
+        body = self._read_body(handler)
+        return json.loads(body) if body else {}
+
+    def _reply(self, handler, status, data):
+        content_type = 'application/octet-stream'
+        body = data
+        if not isinstance(data, bytes):
+            content_type = 'application/json'
+            body = json.dumps(data if data is not None else {}).encode('utf-8')
+
+        etag = None
+        if handler.command == 'GET' and status == 200:
+            etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+            if handler.headers.get('If-None-Match') == etag:
+                (status, body) = (304, b'')
+
+        handler.send_response(status)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Content-Length', str(len(body)))
+        if etag is not None:
+            handler.send_header('ETag', etag)
+        handler.end_headers()
+
+        if handler.command != 'HEAD':
+            handler.wfile.write(body)
+
+    def _new_box(self, username, name):
+        box = self.boxes.get(name)
+        if box is None:
+            box = {
+                'username': username,
+                'name': name,
+                'short_description': '',
+                'versions': {}
+            }
+            self.boxes[name] = box
+
+        return box
+
+    def _new_version(self, version):
+        return {
+            'version': version,
+            'status': 'unreleased',
+            'description': '',
+            'providers': {}
+        }
+
+    def _box_json(self, box):
+        released = [
+            v for v in box['versions'].values() if v['status'] == 'active'
+        ]
+        current = released[-1] if released else None
+
+        return {
+            'tag': f'{box["username"]}/{box["name"]}',
+            'username': box['username'],
+            'name': box['name'],
+            'short_description': box['short_description'],
+            'current_version': self._version_json(current) if current else None,
+            'versions': [self._version_json(v) for v in box['versions'].values()]
+        }
+
+    def _version_json(self, version):
+        return {
+            'version': version['version'],
+            'status': version['status'],
+            'description': version['description'],
+            'providers': [
+                self._provider_json(p) for p in version['providers'].values()
+            ]
+        }
+
+    def _provider_json(self, provider):
+        return {
+            'name': provider['name'],
+            'checksum_type': provider.get('checksum_type'),
+            'checksum': provider.get('checksum'),
+            'hosted': True,
+            'download_url': '{}/download/{}/{}/{}'.format(
+                self.root, *provider['path'], provider['name']
+            )
+        }
+
+    def _get(self, boxname, version=None, provider=None):
+        box = self.boxes.get(boxname)
+        if box is None or version is None:
+            return box
+
+        version = box['versions'].get(version)
+        if version is None or provider is None:
+            return version
+
+        return version['providers'].get(provider)
+
+    def _not_found(self):
+        return (404, {'errors': ['Resource not found!']})
+
+    def search(self, handler):
+        query = parse_qs(urlsplit(handler.path).query)
+        limit = min(int(query.get('limit', ['10'])[0]), self.page_limit)
+        page = int(query.get('page', ['1'])[0])
+
+        boxes = [self._box_json(b) for b in self.boxes.values()]
+        boxes.sort(key=lambda b: b['tag'])
+        return (200, {'boxes': boxes[(page - 1) * limit:page * limit]})
+
+    def _conflict(self, what):
+        return (422, {'errors': [f'{what} has already been taken']})
+
+    def box_create(self, handler):
+        data = self._read_json(handler)['box']
+        if data['name'] in self.boxes:
+            return self._conflict('Name')
+
+        box = self._new_box(data.get('username', self.username), data['name'])
+        box['short_description'] = data.get('short_description', '')
+        return (200, self._box_json(box))
+
+    def box_get(self, handler, username, boxname):
+        box = self._get(boxname)
+        return (200, self._box_json(box)) if box else self._not_found()
+
+    def box_update(self, handler, username, boxname):
+        data = self._read_json(handler).get('box', {})
+        box = self._get(boxname)
+        if box is None:
+            return self._not_found()
+
+        box['short_description'] = data.get(
+            'short_description', box['short_description']
+        )
+        return (200, self._box_json(box))
+
+    def version_create(self, handler, username, boxname):
+        data = self._read_json(handler)['version']
+        box = self._get(boxname)
+        if box is None:
+            return self._not_found()
+
+        if data['version'] in box['versions']:
+            return self._conflict('Version')
+
+        version = box['versions'].setdefault(
+            data['version'], self._new_version(data['version'])
+        )
+        version['description'] = data.get('description', '')
+        return (200, self._version_json(version))
+
+    def version_get(self, handler, username, boxname, version):
+        data = self._get(boxname, version)
+        return (200, self._version_json(data)) if data else self._not_found()
+
+    def version_update(self, handler, username, boxname, version):
+        update = self._read_json(handler).get('version', {})
+        data = self._get(boxname, version)
+        if data is None:
+            return self._not_found()
+
+        data['description'] = update.get('description', data['description'])
+        return (200, self._version_json(data))
+
+    def version_delete(self, handler, username, boxname, version):
+        box = self._get(boxname)
+        if box is None or version not in box['versions']:
+            return self._not_found()
+
+        return (200, self._version_json(box['versions'].pop(version)))
+
+    def version_release(self, handler, username, boxname, version):
+        self._read_body(handler)
+        data = self._get(boxname, version)
+        if data is None:
+            return self._not_found()
+
+        data['status'] = 'active'
+        return (200, self._version_json(data))
+
+    def provider_create(self, handler, username, boxname, version):
+        data = self._read_json(handler)['provider']
+        parent = self._get(boxname, version)
+        if parent is None:
+            return self._not_found()
+
+        if data['name'] in parent['providers']:
+            return self._conflict('Provider')
+
+        provider = parent['providers'].setdefault(data['name'], {
+            'name': data['name'],
+            'path': (boxname, version),
+            'data': bytearray()
+        })
+        provider.update({
+            k: v for k, v in data.items() if k in ('checksum', 'checksum_type')
+        })
+        return (200, self._provider_json(provider))
+
+    def provider_get(self, handler, username, boxname, version, provider):
+        data = self._get(boxname, version, provider)
+        return (200, self._provider_json(data)) if data else self._not_found()
+
+    def provider_update(self, handler, username, boxname, version, provider):
+        update = self._read_json(handler).get('provider', {})
+        data = self._get(boxname, version, provider)
+        if data is None:
+            return self._not_found()
+
+        data.update({
+            k: v for k, v in update.items() if k in ('checksum', 'checksum_type')
+        })
+        return (200, self._provider_json(data))
+
+    def provider_upload_path(self, handler, username, boxname, version, provider):
+        data = self._get(boxname, version, provider)
+        if data is None:
+            return self._not_found()
+
+        token = uuid.uuid4().hex
+        self.uploads[token] = data
+        return (200, {'upload_path': f'{self.root}/upload/{token}'})
+
+    def download(self, handler, boxname, version, provider):
+        data = self._get(boxname, version, provider)
+        if data is None or not data['data']:
+            return self._not_found()
+
+        return (200, bytes(data['data']))
+
+    def upload(self, handler, token):
+        body = self._read_body(handler)
+        provider = self.uploads.get(token)
+        if provider is None:
+            return self._not_found()
+
+        content_type = handler.headers.get('Content-Type', '')
+        if content_type.startswith('multipart/'):
+            decoder = MultipartDecoder(body, content_type)
+            body = decoder.parts[0].content
+
+        content_range = handler.headers.get('Content-Range')
+        if content_range is None or not self.ranged_upload:
+            provider['data'] = bytearray(body)
+            return (200, {})
+
+        match = re.match(r'bytes (\d+)-(\d+)/(\d+)', content_range)
+        (start, end, size) = [int(x) for x in match.groups()]
+        if len(provider['data']) < size:
+            provider['data'].extend(bytes(size - len(provider['data'])))
+
+        provider['data'][start:end + 1] = body
+        return (200, {})
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+#
+#    Authors:
+#        Pavel Březina <pbrezina@redhat.com>
+#
+#    Copyright (C) 2019 Red Hat
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+import yaml
+
+
+class GuestFingerprint:
+    """
+    Fingerprint of inputs that affect the box of a guest: base box, its
+    configuration, playbooks and roles that are applied to the guest,
+    Ansible variables and inventory and the packaged Vagrantfile.
+    """
+
+    def __init__(self, project_dir, config_file, playbooks):
+        self.project_dir = project_dir
+        self.ansible_dir = f'{project_dir}/provision'
+        self.config_file = config_file
+        self.playbooks = playbooks
+
+    def compute(self, guest, base_box, extra=None):
+        inputs = self.inputs(guest, base_box, extra)
+        digest = hashlib.sha256(
+            json.dumps(inputs, sort_keys=True).encode('utf-8')
+        ).hexdigest()
+
+        return (digest, inputs)
+
+    def inputs(self, guest, base_box, extra=None):
+        files = [
+            f'{self.ansible_dir}/variables.yml',
+            f'{self.ansible_dir}/inventory.yml',
+            f'{self.ansible_dir}/ansible.cfg',
+            *self.playbooks,
+        ]
+
+        for role in sorted(self.roles(guest)):
+            files.extend(self.walk(f'{self.ansible_dir}/roles/{role}'))
+
+        return {
+            'guest': guest,
+            'base_box': base_box,
+            'config': self.config(guest),
+            'files': {
+                os.path.relpath(path, self.project_dir): self.hash_file(path)
+                for path in files
+            },
+            **(extra if extra is not None else {})
+        }
+
+    def config(self, guest):
+        try:
+            with open(self.config_file) as f:
+                config = json.load(f)
+        except FileNotFoundError:
+            return None
+
+        return config.get('boxes', {}).get(guest)
+
+    def groups(self, guest):
+        with open(f'{self.ansible_dir}/inventory.yml') as f:
+            inventory = yaml.safe_load(f)
+
+        groups = {'all', guest}
+        for name, group in inventory['all'].get('children', {}).items():
+            if guest in (group.get('hosts') or {}):
+                groups.add(name)
+
+        return groups
+
+    def roles(self, guest):
+        groups = self.groups(guest)
+        roles = set()
+        for playbook in self.playbooks:
+            with open(playbook) as f:
+                plays = yaml.safe_load(f) or []
+
+            for play in plays:
+                if not groups.intersection(play.get('hosts', '').split(':')):
+                    continue
+
+                for role in play.get('roles', []):
+                    roles.add(role['role'] if isinstance(role, dict) else role)
+
+        return roles
+
+    def walk(self, path):
+        files = []
+        for root, dirs, names in os.walk(path):
+            dirs.sort()
+            files.extend(os.path.join(root, name) for name in sorted(names))
+
+        return files
+
+    def hash_file(self, path):
+        sha256 = hashlib.sha256()
+        try:
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(65536), b''):
+                    sha256.update(block)
+        except FileNotFoundError:
+            return None
+
+        return sha256.hexdigest()
+
+
+class BoxFingerprints:
+    """
+    Fingerprints of the last boxes built in an output directory.
+    """
+
+    # Shared by all instances, each guest pipeline records its own box.
+    lock = threading.Lock()
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.path = f'{output_dir}/fingerprints.json'
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def is_built(self, guest, fingerprint):
+        entry = self.load().get(guest)
+        if entry is None or entry['fingerprint'] != fingerprint:
+            return False
+
+        return os.path.exists(f'{self.output_dir}/{entry["box"]}')
+
+    def last_box(self, guest):
+        entry = self.load().get(guest)
+        return entry['box'] if entry is not None else None
+
+    def record(self, guest, fingerprint, box, inputs):
+        with self.lock:
+            entries = self.load()
+            entries[guest] = {
+                'fingerprint': fingerprint,
+                'box': box,
+                'inputs': inputs
+            }
+
+            (fd, tmp) = tempfile.mkstemp(dir=self.output_dir, prefix='.fingerprints.')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(entries, f, indent=4, sort_keys=True)
+
+                os.replace(tmp, self.path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+#
+#    Authors:
+#        Pavel Březina <pbrezina@redhat.com>
+#
+#    Copyright (C) 2019 Red Hat
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+
+def tree_digest(path):
+    """
+    Digest of names, sizes and modification times of all files in a
+    directory tree. It changes whenever a file is added, removed or modified.
+    """
+    h = hashlib.sha256()
+    for (root, dirs, files) in os.walk(path):
+        dirs.sort()
+        for name in sorted(dirs + files):
+            fullpath = os.path.join(root, name)
+            try:
+                stat = os.lstat(fullpath)
+            except FileNotFoundError:
+                continue
+
+            h.update('{}\0{}\0{}\0{}\n'.format(
+                os.path.relpath(fullpath, path), stat.st_mode, stat.st_size,
+                stat.st_mtime_ns
+            ).encode('utf-8', 'surrogateescape'))
+
+    return h.hexdigest()
+
+
+def synced_folders(config_file, env, folder_type):
+    """
+    Return host to guest mapping of synced folders of given type, the same
+    way as ruby/config.rb reads them from configuration and environment.
+    """
+    if env.get('SSSD_TEST_SUITE_BOX') == 'yes':
+        return {}
+
+    try:
+        with open(config_file) as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        config = {}
+
+    folders = {}
+    for folder in (config.get('folders') or {}).get(folder_type) or []:
+        if folder.get('host') and folder.get('guest'):
+            folders[folder['host']] = folder['guest']
+
+    variable = f'SSSD_TEST_SUITE_{folder_type.upper()}'
+    for mount in env.get(variable, '').split():
+        (host, guest) = mount.split(':', 1)
+        folders[host] = guest
+
+    return folders
+
+
+class GuestStartState:
+    """
+    Record of folders synced to running guests and of how long it took to
+    start them, so a running guest does not have to be started again and
+    its folders are synced only when they have changed. Each entry is bound
+    to the machine id of the guest.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.entries = {}
+
+        return self
+
+    def get(self, guest, machine):
+        entry = self.entries.get(guest)
+        if entry is None or machine is None or entry.get('machine') != machine:
+            return None
+
+        return entry
+
+    def record(self, guest, machine, **values):
+        with self.lock:
+            entry = self.entries.get(guest)
+            if entry is None or entry.get('machine') != machine:
+                entry = {'machine': machine}
+
+            self.entries[guest] = {**entry, **values}
+
+    def forget(self, guests):
+        with self.lock:
+            for guest in guests:
+                self.entries.pop(guest, None)
+
+    def save(self):
+        with self.lock:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            (fd, tmp) = tempfile.mkstemp(
+                dir=os.path.dirname(self.path),
+                prefix=f'.{os.path.basename(self.path)}.'
+            )
+
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(self.entries, f, indent=2)
+
+                os.replace(tmp, self.path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+#
+#    Authors:
+#        Pavel Březina <pbrezina@redhat.com>
+#
+#    Copyright (C) 2019 Red Hat
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import json
+import os
+
+
+class QcowConversion:
+    """
+    Options of qemu-img convert that writes a qcow2 image.
+    """
+
+    CompressionTypes = ['none', 'zlib', 'zstd']
+
+    def __init__(self, coroutines=8, out_of_order=False, compression='none', cluster_size=None):
+        if compression not in self.CompressionTypes:
+            raise ValueError(f'Unsupported compression type: {compression}')
+
+        self.coroutines = coroutines
+        self.out_of_order = out_of_order
+        self.compression = compression
+        self.cluster_size = cluster_size
+
+    def __str__(self):
+        items = [f'm={self.coroutines}', f'c={self.compression}']
+        if self.out_of_order:
+            items.append('W')
+
+        if self.cluster_size:
+            items.append(f'cluster={self.cluster_size}')
+
+        return ','.join(items)
+
+    def options(self):
+        options = []
+        # zlib is the default, compression_type is available since qemu 5.1
+        if self.compression not in ['none', 'zlib']:
+            options.append(f'compression_type={self.compression}')
+
+        if self.cluster_size:
+            options.append(f'cluster_size={self.cluster_size}')
+
+        return ['-o', ','.join(options)] if options else []
+
+    def command(self, source, destination):
+        args = ['qemu-img', 'convert', '-O', 'qcow2', '-m', str(self.coroutines)]
+        if self.out_of_order:
+            args.append('-W')
+
+        if self.compression != 'none':
+            args.append('-c')
+
+        return [*args, *self.options(), source, destination]
+
+    def measure_command(self, source):
+        options = ['-o', f'cluster_size={self.cluster_size}'] if self.cluster_size else []
+        return ['qemu-img', 'measure', '--output=json', '-O', 'qcow2', *options, source]
+
+    def parse_measure(self, output):
+        """
+        Return size of the converted image without compression, this is
+        an upper bound of the compressed image size.
+        """
+        return json.loads(output)['required']
+
+
+def allocated_size(path):
+    try:
+        return os.stat(path).st_blocks * 512
+    except OSError:
+        return None
+
+
+def format_size(value):
+    if value is None:
+        return '-'
+
+    return f'{value / 1024 / 1024:.0f} MiB'
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#
+#    Authors:
+#        Pavel Březina <pbrezina@redhat.com>
+#
+#    Copyright (C) 2019 Red Hat
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import hashlib
+import inspect
+import json
+import os
+import tempfile
+import threading
+
+from nutcli.decorators import SideEffect
+
+
+class TaskJournal:
+    """
+    Persistent record of finished tasks so an interrupted or failed task
+    list can be resumed. Tasks are identified by a key computed from their
+    identity and inputs, therefore a task is not skipped if its inputs have
+    changed since it was finished.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.resume = resume
+        self.lock = threading.Lock()
+        self.finished = set()
+        self.skipped = 0
+
+        if resume:
+            self.finished = set(self._read())
+        else:
+            self.remove()
+
+    def key(self, *identity):
+        return hashlib.sha256(
+            json.dumps(identity, sort_keys=True, default=str).encode('utf-8')
+        ).hexdigest()
+
+    def is_finished(self, key):
+        with self.lock:
+            return key in self.finished
+
+    def mark(self, key):
+        with self.lock:
+            self.finished.add(key)
+            self._write(sorted(self.finished))
+
+    @SideEffect()
+    def remove(self):
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def checkpoint(self, key, handler, *args, record=True, **kwargs):
+        """
+        Return task handler that is skipped if task ``key`` has finished.
+        Otherwise ``handler`` is called and, if ``record`` is True, the task
+        is recorded as finished. Tasks that only restore state required by
+        another task (e.g. start a guest) should use the key of that task
+        with ``record`` set to False.
+        """
+        accepts_task = 'task' in inspect.signature(handler).parameters
+
+        def run(task):
+            if self.is_finished(key):
+                task.info('Already finished, skipping')
+                with self.lock:
+                    self.skipped += 1
+                return
+
+            if accepts_task:
+                handler(*args, task=task, **kwargs)
+            else:
+                handler(*args, **kwargs)
+
+            if record:
+                self.mark(key)
+
+        return run
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return []
+
+    @SideEffect()
+    def _write(self, finished):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        (fd, tmp) = tempfile.mkstemp(
+            dir=os.path.dirname(self.path),
+            prefix=f'.{os.path.basename(self.path)}.'
+        )
+
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(finished, f)
+
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
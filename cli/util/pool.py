@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+#
+#    Authors:
+#        Pavel Březina <pbrezina@redhat.com>
+#
+#    Copyright (C) 2019 Red Hat
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import re
+
+
+class StoragePool:
+    """
+    Volumes of libvirt storage pool. The pool is listed with a single virsh
+    call and volumes are deleted in batches, each batch by one virsh process.
+    """
+
+    Units = {
+        'B': 1, 'bytes': 1, 'KiB': 1024, 'MiB': 1024 ** 2, 'GiB': 1024 ** 3,
+        'TiB': 1024 ** 4, 'PiB': 1024 ** 5,
+    }
+
+    def __init__(self, name='sssd-test-suite'):
+        self.name = name
+
+    @staticmethod
+    def box_volume(box, version):
+        """
+        Name of the volume with image of box ``box`` in version ``version``
+        as created by vagrant-libvirt.
+        """
+        return '{box}_vagrant_box_image_{version}.img'.format(
+            box=box.replace('/', '-VAGRANTSLASH-'),
+            version=version
+        )
+
+    def list_command(self):
+        return ['virsh', 'vol-list', '--pool', self.name, '--details']
+
+    def parse(self, output):
+        """
+        Parse output of ``list_command()``, return dictionary of volume name
+        and its allocated size in bytes.
+        """
+        regex = re.compile(
+            r'^\s*(\S+)\s+(\S+)\s+\S+\s+[\d.]+\s+\S+\s+([\d.]+)\s+(\S+)\s*$',
+            re.MULTILINE
+        )
+
+        volumes = {}
+        for (name, _, allocation, unit) in regex.findall(output or ''):
+            if unit not in self.Units:
+                continue
+
+            volumes[name] = int(float(allocation) * self.Units[unit])
+
+        return volumes
+
+    def delete_commands(self, volumes, jobs=4):
+        """
+        Return virsh commands that delete ``volumes``, split into at most
+        ``jobs`` batches that can run in parallel.
+        """
+        volumes = sorted(volumes)
+        batches = [volumes[i::jobs] for i in range(min(jobs, len(volumes)))]
+
+        return [
+            ['virsh', '; '.join(
+                f'vol-delete --pool {self.name} {volume}' for volume in batch
+            )]
+            for batch in batches
+        ]
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+#
+#    Authors:
+#        Pavel Březina <pbrezina@redhat.com>
+#
+#    Copyright (C) 2019 Red Hat
+#
+#    This program is free software; you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation; either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+import os
+import tempfile
+
+from util.domains import machine_id
+
+
+class SSHConfigCache:
+    """
+    Cache of 'vagrant ssh-config' output so guests can be reached with ssh
+    directly, without starting vagrant. Each entry is bound to the machine id
+    of the guest and it is ignored once the guest is recreated. Connections
+    are multiplexed over a persistent master connection for each guest.
+    """
+
+    Header = '# machine-id: '
+
+    def __init__(self, vagrant_dir, cache_dir=None, control_dir=None, persist=600):
+        self.vagrant_dir = vagrant_dir
+        self.cache_dir = cache_dir
+        self.control_dir = control_dir
+        self.persist = persist
+
+        if self.cache_dir is None:
+            self.cache_dir = f'{vagrant_dir}/.vagrant/ssh-config'
+
+        # Keep the socket path short, it is limited to about 100 characters.
+        if self.control_dir is None:
+            self.control_dir = '{}/sssd-test-suite-{}'.format(
+                os.environ.get('XDG_RUNTIME_DIR', tempfile.gettempdir()),
+                os.getuid()
+            )
+
+    def path(self, guest):
+        return f'{self.cache_dir}/{guest}'
+
+    def lookup(self, guest):
+        machine = machine_id(self.vagrant_dir, guest)
+        if machine is None:
+            return None
+
+        try:
+            with open(self.path(guest)) as f:
+                header = f.readline().rstrip('\n')
+        except FileNotFoundError:
+            return None
+
+        if header != self.Header + machine:
+            return None
+
+        return self.path(guest)
+
+    def store(self, guest, config):
+        machine = machine_id(self.vagrant_dir, guest)
+        if machine is None or not config:
+            return None
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        (fd, tmp) = tempfile.mkstemp(dir=self.cache_dir, prefix=f'.{guest}.')
+
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(f'{self.Header}{machine}\n{config}')
+
+            os.replace(tmp, self.path(guest))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+        return self.path(guest)
+
+    def invalidate(self, guest):
+        try:
+            os.unlink(self.path(guest))
+        except FileNotFoundError:
+            pass
+
+    def options(self):
+        return [
+            '-o', 'ControlMaster=auto',
+            '-o', f'ControlPath={self.control_dir}/%C',
+            '-o', f'ControlPersist={self.persist}',
+        ]
+
+    def ssh_command(self, guest, argv=None):
+        os.makedirs(self.control_dir, mode=0o700, exist_ok=True)
+
+        return [
+            'ssh', '-F', self.path(guest), *self.options(), guest,
+            *(argv if argv is not None else [])
+        ]
+
+    def control_command(self, guest, operation='exit'):
+        return [
+            'ssh', '-F', self.path(guest), *self.options(), '-O', operation,
+            guest
+        ]
@@ -20,29 +20,450 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 
+import asyncio
+import contextlib
+import functools
 import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from urllib.parse import urlencode
 
 import requests
 from clint.textui.progress import Bar as ProgressBar
+from requests.adapters import HTTPAdapter
 from requests_toolbelt import MultipartEncoder, MultipartEncoderMonitor
 
 
+class RequestStatistics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+        self.total_time = 0.0
+        self.connect_time = 0.0
+        self.response_time = 0.0
+
+    def add_request(self, response, duration):
+        with self.lock:
+            self.requests += 1
+            self.total_time += duration
+            self.response_time += response.elapsed.total_seconds()
+
+    def add_connection(self, duration):
+        with self.lock:
+            self.connections += 1
+            self.connect_time += duration
+
+    @property
+    def server_time(self):
+        # Response time is measured from sending the request until the
+        # headers are received, which includes establishing new connections.
+        return max(self.response_time - self.connect_time, 0.0)
+
+    @property
+    def transfer_time(self):
+        return max(self.total_time - self.response_time, 0.0)
+
+    def summary(self):
+        return [
+            f'Requests: {self.requests} over {self.connections} connection(s)',
+            f'Total time: {self.total_time:.3f}s',
+            f'Connection setup: {self.connect_time:.3f}s',
+            f'Server time: {self.server_time:.3f}s',
+            f'Body transfer: {self.transfer_time:.3f}s',
+        ]
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """
+    HTTP adapter that reports time spent on establishing new connections
+    (TCP and TLS handshake) to request statistics.
+    """
+
+    def __init__(self, statistics, *args, **kwargs):
+        self.statistics = statistics
+        super().__init__(*args, **kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+
+        statistics = self.statistics
+
+        class TimedPoolMixin:
+            def _new_conn(self):
+                conn = super()._new_conn()
+                connect = conn.connect
+
+                def timed_connect():
+                    start = time.monotonic()
+                    connect()
+                    statistics.add_connection(time.monotonic() - start)
+
+                conn.connect = timed_connect
+                return conn
+
+        self.poolmanager.pool_classes_by_scheme = {
+            scheme: type(cls.__name__, (TimedPoolMixin, cls), {})
+            for scheme, cls in self.poolmanager.pool_classes_by_scheme.items()
+        }
+
+
+class ResponseCache:
+    """
+    Persistent cache of GET responses. Entries younger than ``ttl`` seconds
+    are returned without contacting the server, older entries are
+    revalidated with ETag and Last-Modified conditional requests.
+    """
+
+    def __init__(self, path, ttl=300):
+        self.path = path
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.dirty = False
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, ValueError):
+            self.entries = {}
+
+        return self
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+
+            tmp = f'{self.path}.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self.entries, f)
+
+            os.replace(tmp, self.path)
+            self.dirty = False
+
+    def key(self, url, params=None):
+        if not params:
+            return url
+
+        return '{}?{}'.format(url, urlencode(sorted(params.items())))
+
+    def lookup(self, key):
+        with self.lock:
+            return self.entries.get(key)
+
+    def is_fresh(self, entry):
+        return time.time() - entry['time'] < self.ttl
+
+    def validators(self, entry):
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+
+        return headers
+
+    def response(self, entry):
+        r = requests.Response()
+        r.status_code = entry['status']
+        r.url = entry['url']
+        r._content = entry['body'].encode('utf-8')
+        r.encoding = 'utf-8'
+        return r
+
+    def hit(self, key, entry, revalidated=False):
+        with self.lock:
+            if revalidated:
+                self.revalidated += 1
+                entry['time'] = time.time()
+                self.dirty = True
+            else:
+                self.hits += 1
+
+        return self.response(entry)
+
+    def store(self, key, response):
+        with self.lock:
+            self.misses += 1
+
+            if response.status_code not in (requests.codes.ok, requests.codes.not_found):
+                return
+
+            self.entries[key] = {
+                'url': response.url,
+                'status': response.status_code,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'time': time.time(),
+                'body': response.text
+            }
+            self.dirty = True
+
+    def invalidate(self, url):
+        with self.lock:
+            for key in list(self.entries):
+                if key == url or key.startswith((url + '/', url + '?')):
+                    del self.entries[key]
+                    self.dirty = True
+
+    def summary(self):
+        return [
+            f'Cache hits: {self.hits}',
+            f'Cache revalidated: {self.revalidated}',
+            f'Cache misses: {self.misses}',
+        ]
+
+
+class UploadJournal:
+    """
+    On-disk record of byte ranges that were already uploaded so an
+    interrupted chunked upload can be resumed.
+    """
+
+    def __init__(self, path, key):
+        self.path = path
+        self.key = key
+        self.upload_path = None
+        self.ranges = []
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return False
+
+        if data.get('key') != self.key:
+            return False
+
+        self.upload_path = data['upload_path']
+        self.ranges = [tuple(r) for r in data['ranges']]
+        return True
+
+    def save(self):
+        tmp = f'{self.path}.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({
+                'key': self.key,
+                'upload_path': self.upload_path,
+                'ranges': self.ranges
+            }, f)
+
+        os.replace(tmp, self.path)
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def add(self, start, end):
+        ranges = []
+        for (rstart, rend) in sorted(self.ranges + [(start, end)]):
+            if ranges and rstart <= ranges[-1][1]:
+                ranges[-1] = (ranges[-1][0], max(ranges[-1][1], rend))
+                continue
+
+            ranges.append((rstart, rend))
+
+        self.ranges = ranges
+
+    def contains(self, start, end):
+        for (rstart, rend) in self.ranges:
+            if rstart <= start and end <= rend:
+                return True
+
+        return False
+
+    @property
+    def completed(self):
+        return sum(end - start for (start, end) in self.ranges)
+
+
+class UploadProgress:
+    """
+    Single progress bar that aggregates several concurrent uploads.
+    """
+
+    def __init__(self, count):
+        self.lock = threading.Lock()
+        self.count = count
+        self.finished = 0
+        self.failed = 0
+        self.sizes = {}
+        self.sent = {}
+        self.bar = ProgressBar(filled_char='=')
+
+    def start(self, key, size):
+        with self.lock:
+            self.sizes[key] = size
+            self.sent[key] = 0
+            self._show()
+
+    def update(self, key, sent):
+        with self.lock:
+            self.sent[key] = sent
+            self._show()
+
+    def finish(self, key, success=True):
+        with self.lock:
+            if success:
+                self.finished += 1
+                self.sent[key] = self.sizes.get(key, 0)
+            else:
+                self.failed += 1
+                self.sizes.pop(key, None)
+                self.sent.pop(key, None)
+
+            self._show()
+
+    def done(self):
+        with self.lock:
+            if self.bar.expected_size:
+                self.bar.done()
+
+    def _show(self):
+        total = sum(self.sizes.values())
+        if not total:
+            return
+
+        active = self.count - self.finished - self.failed
+        self.bar.label = '[{}/{} done, {} active, {} failed] '.format(
+            self.finished, self.count, active, self.failed
+        )
+        self.bar.show(sum(self.sent.values()), count=total)
+
+
+class VagrantCloudPruner:
+    """
+    Delete outdated box versions. Versions are listed and deleted
+    concurrently, deletion starts as soon as versions of a box are known.
+    A box whose versions can not be listed is counted as failed and the
+    other boxes are still pruned.
+    """
+
+    def __init__(self, api, keep=2, jobs=8):
+        self.api = api
+        self.keep = keep
+        self.jobs = jobs
+        self.boxes = 0
+        self.versions = 0
+        self.plan = []
+        self.deleted = []
+        self.failed = []
+        self.failed_boxes = []
+        self.plan_time = 0.0
+        self.total_time = 0.0
+
+    def outdated(self, versions):
+        return versions[:max(len(versions) - self.keep, 0)]
+
+    def run(self, dry_run=False, callback=None):
+        return asyncio.run(self.run_async(dry_run, callback))
+
+    async def run_async(self, dry_run=False, callback=None):
+        start = time.monotonic()
+        with AsyncVagrantCloud(self.api, self.jobs) as cloud:
+            deletes = []
+            listings = []
+            try:
+                async for box in cloud.iter_boxes():
+                    self.boxes += 1
+                    listings.append(asyncio.ensure_future(
+                        self.plan_box(cloud, box, dry_run, callback, deletes)
+                    ))
+            except Exception as e:
+                self.failed_boxes.append((None, e))
+                if callback is not None:
+                    callback(None, None, e)
+
+            await asyncio.gather(*listings)
+
+            self.plan_time = time.monotonic() - start
+            self.plan.sort()
+
+            await asyncio.gather(*deletes)
+
+        self.total_time = time.monotonic() - start
+
+        return len(self.failed) == 0 and len(self.failed_boxes) == 0
+
+    async def plan_box(self, cloud, box, dry_run, callback, deletes):
+        try:
+            versions = await cloud.list_versions(box.name)
+        except Exception as e:
+            self.failed_boxes.append((box.name, e))
+            if callback is not None:
+                callback(box.name, None, e)
+            return
+
+        self.versions += len(versions)
+        for version in self.outdated(versions):
+            self.plan.append((box.name, version))
+            if not dry_run:
+                deletes.append(asyncio.ensure_future(
+                    self.delete(cloud, box.name, version, callback)
+                ))
+
+    async def delete(self, cloud, name, version, callback):
+        error = None
+        try:
+            await cloud.version_delete(name, version)
+            self.deleted.append((name, version))
+        except Exception as e:
+            error = e
+            self.failed.append((name, version, error))
+
+        if callback is not None:
+            callback(name, version, error)
+
+    def summary(self):
+        return [
+            f'Boxes scanned: {self.boxes}',
+            f'Versions found: {self.versions}',
+            f'Versions outdated: {len(self.plan)}',
+            f'Versions deleted: {len(self.deleted)}',
+            f'Versions failed: {len(self.failed)}',
+            f'Boxes failed: {len(self.failed_boxes)}',
+            f'Planning time: {self.plan_time:.3f}s',
+            f'Total time: {self.total_time:.3f}s',
+        ]
+
+
 class VagrantCloud:
     class Box:
         def __init__(self, data):
             self.tag = data['tag']
             self.username = data['username']
             self.name = data['name']
-            self.version = data['current_version']['version']
+            self.version = (data.get('current_version') or {}).get('version')
 
         def __lt__(self, other):
             return self.tag < other.tag
 
-    def __init__(self, username, token):
+    def __init__(
+        self, username, token, pool_size=10, url=None, retries=5, backoff=1.0,
+        cache=None
+    ):
         self.check_credentials(username, token)
         self.username = username
         self.token = token
-        self.url = 'https://app.vagrantup.com/api/v1'
+        self.url = url if url is not None else 'https://app.vagrantup.com/api/v1'
+        self.retries = retries
+        self.backoff = backoff
+        self.stats = RequestStatistics()
+        self.session = self.create_session(pool_size)
+        self.cache = cache
+        self.local = threading.local()
         self.api = {
             'search': '{url}/search',
             'box': {
@@ -69,6 +490,46 @@ class VagrantCloud:
             'Authorization': 'Bearer %s' % self.token
         }
 
+    def create_session(self, pool_size):
+        adapter = TimedHTTPAdapter(
+            self.stats, pool_connections=pool_size, pool_maxsize=pool_size
+        )
+
+        session = requests.Session()
+        session.headers.update({'Connection': 'keep-alive'})
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+        return session
+
+    def close(self):
+        self.session.close()
+        if self.cache is not None:
+            self.cache.save()
+
+    def request(self, method, url, **kwargs):
+        start = time.monotonic()
+        r = self.session.request(method, url, **kwargs)
+        self.stats.add_request(r, time.monotonic() - start)
+
+        for counter in getattr(self.local, 'counters', []):
+            counter.requests += 1
+
+        return r
+
+    @contextlib.contextmanager
+    def count_requests(self):
+        """
+        Count requests sent from the current thread inside the context.
+        """
+        counter = SimpleNamespace(requests=0)
+        counters = self.local.__dict__.setdefault('counters', [])
+        counters.append(counter)
+        try:
+            yield counter
+        finally:
+            counters.remove(counter)
+
     def check_credentials(self, username, token):
         if not username:
             raise ValueError('Vagrant cloud username is not set.')
@@ -77,27 +538,79 @@ class VagrantCloud:
             raise ValueError('Vagrant cloud token is not set.')
 
     def api_error(self, response):
-        if response.status_code == requests.codes.ok:
+        if response.ok:
             return True
 
         print('Error %d on: %s' % (response.status_code, response.url))
 
-        data = response.json()
+        try:
+            data = response.json()
+        except ValueError:
+            data = {}
+
         if 'errors' in data:
             for error in data['errors']:
                 print('- %s' % error)
 
         response.raise_for_status()
 
-    def api_get(self, endpoint, args=None, params=None):
+    def api_retry(self, method, url, **kwargs):
+        """
+        Send request and retry it with exponential backoff on server errors
+        and broken connections.
+        """
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            try:
+                r = self.request(method, url, **kwargs)
+                if r.status_code < 500 or last:
+                    self.api_error(r)
+                    return r
+            except (requests.ConnectionError, requests.Timeout,
+                    requests.exceptions.ChunkedEncodingError):
+                if last:
+                    raise
+
+            time.sleep(self.backoff * 2 ** attempt)
+
+    def cached_get(self, url, params=None):
+        if self.cache is None:
+            return self.request('GET', url, headers=self.authheader, params=params)
+
+        key = self.cache.key(url, params)
+        entry = self.cache.lookup(key)
+        if entry is not None and self.cache.is_fresh(entry):
+            return self.cache.hit(key, entry)
+
+        headers = self.cache.validators(entry) if entry is not None else {}
+        r = self.request(
+            'GET', url, headers={**self.authheader, **headers}, params=params
+        )
+
+        if r.status_code == requests.codes.not_modified and entry is not None:
+            return self.cache.hit(key, entry, revalidated=True)
+
+        self.cache.store(key, r)
+        return r
+
+    def invalidate(self, name):
+        if self.cache is None:
+            return
+
+        self.cache.invalidate(self.api['search'].format(url=self.url))
+        self.cache.invalidate(self.api['box']['get'].format(
+            url=self.url, username=self.username, boxname=name
+        ))
+
+    def api_get(self, endpoint, args=None, params=None, cached=False):
         args = args if args is not None else {}
         params = params if params is not None else {}
+        url = endpoint.format(**args, url=self.url)
 
-        r = requests.get(
-            endpoint.format(**args, url=self.url),
-            headers=self.authheader,
-            params=params
-        )
+        if cached:
+            r = self.cached_get(url, params)
+        else:
+            r = self.request('GET', url, headers=self.authheader, params=params)
 
         self.api_error(r)
         return r
@@ -109,8 +622,8 @@ class VagrantCloud:
 
         (data, type) = self.process_data(data, isjson)
 
-        r = requests.post(
-            endpoint.format(**args, url=self.url),
+        r = self.request(
+            'POST', endpoint.format(**args, url=self.url),
             params=params,
             headers={**self.authheader, **headers, **type},
             data=data
@@ -127,8 +640,8 @@ class VagrantCloud:
         (data, type) = self.process_data(data, isjson)
         auth = {} if anonymous else self.authheader
 
-        r = requests.put(
-            endpoint.format(**args, url=self.url),
+        r = self.request(
+            'PUT', endpoint.format(**args, url=self.url),
             params=params,
             headers={**auth, **headers, **type},
             data=data
@@ -141,8 +654,8 @@ class VagrantCloud:
         args = args if args is not None else {}
         params = params if params is not None else {}
 
-        r = requests.delete(
-            endpoint.format(**args, url=self.url),
+        r = self.request(
+            'DELETE', endpoint.format(**args, url=self.url),
             headers=self.authheader,
             params=params
         )
@@ -161,10 +674,7 @@ class VagrantCloud:
     def object_exists(self, endpoints, args=None):
         args = args if args is not None else {}
 
-        r = requests.get(
-            endpoints['get'].format(**args, url=self.url),
-            headers=self.authheader
-        )
+        r = self.cached_get(endpoints['get'].format(**args, url=self.url))
 
         if r.status_code == requests.codes.ok:
             return True
@@ -174,36 +684,77 @@ class VagrantCloud:
 
         r.raise_for_status()
 
-    def object_create(self, endpoints, data, args=None):
+    def object_create(self, endpoints, data, args=None, likely=None):
+        """
+        Create the object or update it if it already exists.
+
+        If ``likely`` is ``'create'`` or ``'update'`` the operation is sent
+        right away without checking existence first and the other operation
+        is used only if the object turns out to be missing or already
+        existing.
+        """
         args = args if args is not None else {}
 
-        if self.object_exists(endpoints, args=args):
-            self.api_put(endpoints['update'], data, args=args)
+        if likely is None:
+            if self.object_exists(endpoints, args=args):
+                self.api_put(endpoints['update'], data, args=args)
+                return
+
+            self.api_post(endpoints['create'], data, args=args)
             return
 
-        self.api_post(endpoints['create'], data, args=args)
+        operations = {
+            'create': ('POST', [requests.codes.conflict, requests.codes.unprocessable]),
+            'update': ('PUT', [requests.codes.not_found]),
+        }
+        fallback = 'update' if likely == 'create' else 'create'
+
+        (body, type) = self.process_data(data, True)
+        for endpoint in (likely, fallback):
+            (method, retry_codes) = operations[endpoint]
+            r = self.request(
+                method, endpoints[endpoint].format(**args, url=self.url),
+                headers={**self.authheader, **type},
+                data=body
+            )
+
+            if r.status_code not in retry_codes:
+                break
 
-    def list_boxes(self):
+        self.api_error(r)
+
+    def list_boxes_page(self, page, page_size=100):
         r = self.api_get(self.api['search'], params={
             'q': self.username + '/',
-            'limit': 100
-        })
+            'limit': page_size,
+            'page': page
+        }, cached=True)
 
-        boxes = []
-        data = r.json()
-        if 'boxes' in data:
-            for box in data['boxes']:
-                boxes.append(self.Box(box))
+        return [self.Box(box) for box in r.json().get('boxes', [])]
+
+    def iter_boxes(self, page_size=100):
+        # Server may return less boxes than requested if page_size is over
+        # its limit, the listing ends with a page shorter than previous ones.
+        page = 1
+        largest = page_size
+        while True:
+            boxes = self.list_boxes_page(page, page_size)
+            yield from boxes
+
+            if not boxes or (page > 1 and len(boxes) < largest):
+                return
 
-        boxes.sort()
+            largest = len(boxes) if page == 1 else largest
+            page += 1
 
-        return boxes
+    def list_boxes(self, page_size=100):
+        return sorted(self.iter_boxes(page_size))
 
     def list_versions(self, boxname):
         r = self.api_get(self.api['box']['get'], args={
             'username': self.username,
             'boxname': boxname
-        })
+        }, cached=True)
 
         versions = []
         data = r.json()
@@ -215,7 +766,7 @@ class VagrantCloud:
 
         return versions
 
-    def box_create(self, name, summary=''):
+    def box_create(self, name, summary='', likely=None):
         data = {
             'box': {
                 'username': self.username,
@@ -229,9 +780,10 @@ class VagrantCloud:
         self.object_create(self.api['box'], data, args={
             'username': self.username,
             'boxname': name
-        })
+        }, likely=likely)
+        self.invalidate(name)
 
-    def version_create(self, name, version, description=''):
+    def version_create(self, name, version, description='', likely=None):
         data = {
             'version': {
                 'version': version,
@@ -243,7 +795,19 @@ class VagrantCloud:
             'username': self.username,
             'boxname': name,
             'version': version
-        })
+        }, likely=likely)
+        self.invalidate(name)
+
+    def version_get(self, name, version):
+        r = self.cached_get(self.api['version']['get'].format(
+            url=self.url, username=self.username, boxname=name, version=version
+        ))
+
+        if r.status_code == requests.codes.not_found:
+            return None
+
+        self.api_error(r)
+        return r.json()
 
     def version_release(self, name, version):
         self.api_put(self.api['version']['release'], None, args={
@@ -251,6 +815,7 @@ class VagrantCloud:
             'boxname': name,
             'version': version
         })
+        self.invalidate(name)
 
     def version_delete(self, name, version):
         self.api_delete(self.api['version']['delete'], args={
@@ -258,22 +823,71 @@ class VagrantCloud:
             'boxname': name,
             'version': version
         })
+        self.invalidate(name)
 
-    def provider_create(self, name, version, provider):
+    def provider_create(
+        self, name, version, provider, checksum=None, checksum_type='sha256',
+        likely=None
+    ):
         data = {
             'provider': {
                 'name': provider
             }
         }
 
+        if checksum is not None:
+            data['provider']['checksum'] = checksum
+            data['provider']['checksum_type'] = checksum_type
+
         self.object_create(self.api['provider'], data, args={
             'username': self.username,
             'boxname': name,
             'version': version,
             'provider': provider
+        }, likely=likely)
+        self.invalidate(name)
+
+    def ensure_container(
+        self, name, version, provider, summary='', description='',
+        checksum=None
+    ):
+        """
+        Make sure that box, version and provider exist. A new version of an
+        existing box is assumed, so the box is updated and the version and
+        provider are created. Each level falls back to the other operation
+        if the guess is wrong.
+        """
+        self.box_create(name, summary, likely='update')
+        self.version_create(name, version, description, likely='create')
+        self.provider_create(name, version, provider, checksum, likely='create')
+
+    def provider_artifact_exists(self, provider):
+        url = provider.get('download_url')
+        if not url:
+            return False
+
+        r = self.request('HEAD', url, headers=self.authheader, allow_redirects=True)
+        return r.ok
+
+    def provider_artifact_size(self, name, version, provider):
+        r = self.api_get(self.api['provider']['get'], args={
+            'username': self.username,
+            'boxname': name,
+            'version': version,
+            'provider': provider
         })
 
-    def provider_upload(self, name, version, provider, file):
+        url = r.json().get('download_url')
+        if not url:
+            return None
+
+        r = self.request('HEAD', url, headers=self.authheader, allow_redirects=True)
+        if not r.ok or 'Content-Length' not in r.headers:
+            return None
+
+        return int(r.headers['Content-Length'])
+
+    def provider_upload(self, name, version, provider, file, progress=None):
         r = self.api_get(self.api['provider']['upload'], args={
             'username': self.username,
             'boxname': name,
@@ -283,20 +897,206 @@ class VagrantCloud:
 
         data = r.json()
 
-        encoder = MultipartEncoder({
-            'file': (file, open(file, 'rb'), 'application/octet-stream')
+        with open(file, 'rb') as f:
+            encoder = MultipartEncoder({
+                'file': (file, f, 'application/octet-stream')
+            })
+
+            if progress is None:
+                bar = ProgressBar(expected_size=encoder.len, filled_char='=')
+
+                def callback(monitor):
+                    bar.show(monitor.bytes_read)
+            else:
+                progress.start(file, encoder.len)
+
+                def callback(monitor):
+                    progress.update(file, monitor.bytes_read)
+
+            monitor = MultipartEncoderMonitor(encoder, callback)
+
+            self.api_put(
+                data['upload_path'], monitor, isjson=False, anonymous=True,
+                headers={
+                    'Content-Type': monitor.content_type
+                }
+            )
+
+        if progress is None:
+            print('')
+
+    def provider_upload_chunked(
+        self, name, version, provider, file, chunk_size, progress=None
+    ):
+        args = {
+            'username': self.username,
+            'boxname': name,
+            'version': version,
+            'provider': provider
+        }
+
+        stat = os.stat(file)
+        size = stat.st_size
+        journal = UploadJournal(f'{file}.upload', {
+            **args,
+            'size': size,
+            'mtime': stat.st_mtime_ns,
+            'chunk_size': chunk_size
         })
-        bar = ProgressBar(expected_size=encoder.len, filled_char='=')
 
-        def callback(monitor):
-            bar.show(monitor.bytes_read)
+        if not journal.load():
+            r = self.api_get(self.api['provider']['upload'], args=args)
+            journal.upload_path = r.json()['upload_path']
+            journal.save()
 
-        monitor = MultipartEncoderMonitor(encoder, callback)
+        if progress is None:
+            bar = ProgressBar(expected_size=max(size, 1), filled_char='=')
+            show = bar.show
+        else:
+            progress.start(file, size)
 
-        self.api_put(
-            data['upload_path'], monitor, isjson=False, anonymous=True,
-            headers={
-                'Content-Type': monitor.content_type
-            }
+            def show(sent):
+                progress.update(file, sent)
+
+        sent = journal.completed
+        show(sent)
+
+        with open(file, 'rb') as f:
+            for start in range(0, size, chunk_size):
+                end = min(start + chunk_size, size)
+                if journal.contains(start, end):
+                    continue
+
+                f.seek(start)
+                data = f.read(end - start)
+
+                try:
+                    self.api_retry('PUT', journal.upload_path, data=data, headers={
+                        'Content-Type': 'application/octet-stream',
+                        'Content-Range': f'bytes {start}-{end - 1}/{size}'
+                    })
+                except requests.HTTPError as e:
+                    # The upload path is no longer accepted, start over.
+                    if e.response is not None and e.response.status_code < 500:
+                        journal.remove()
+                    raise
+
+                journal.add(start, end)
+                journal.save()
+
+                sent += end - start
+                show(sent)
+
+        if progress is None:
+            print('')
+
+        # The server may ignore Content-Range and keep only the last chunk,
+        # the box must not be released in such case.
+        stored = self.provider_artifact_size(name, version, provider)
+        journal.remove()
+        if stored != size:
+            raise RuntimeError(
+                f'Uploaded artifact has {stored} bytes instead of {size} bytes, '
+                'the server probably does not support chunked upload'
+            )
+
+
+class AsyncVagrantCloud:
+    """
+    Asyncio interface to :class:`VagrantCloud`.
+
+    Calls are executed by the blocking client in a thread pool so both
+    interfaces share the same connection pool, cache and statistics. At most
+    ``concurrency`` calls run at the same time.
+    """
+
+    def __init__(self, api, concurrency=8):
+        self.api = api
+        self.concurrency = concurrency
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.semaphore = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    async def run(self, function, *args, **kwargs):
+        # Semaphore must be created inside the running event loop.
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+
+        async with self.semaphore:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, functools.partial(function, *args, **kwargs)
+            )
+
+    async def iter_boxes(self, page_size=100):
+        page = 1
+        largest = page_size
+        while True:
+            boxes = await self.run(self.api.list_boxes_page, page, page_size)
+            for box in boxes:
+                yield box
+
+            if not boxes or (page > 1 and len(boxes) < largest):
+                return
+
+            largest = len(boxes) if page == 1 else largest
+            page += 1
+
+    async def list_boxes(self, page_size=100):
+        return sorted([box async for box in self.iter_boxes(page_size)])
+
+    async def list_versions(self, boxname):
+        return await self.run(self.api.list_versions, boxname)
+
+    async def box_create(self, name, summary='', likely=None):
+        await self.run(self.api.box_create, name, summary, likely)
+
+    async def version_get(self, name, version):
+        return await self.run(self.api.version_get, name, version)
+
+    async def version_create(self, name, version, description='', likely=None):
+        await self.run(self.api.version_create, name, version, description, likely)
+
+    async def version_release(self, name, version):
+        await self.run(self.api.version_release, name, version)
+
+    async def version_delete(self, name, version):
+        await self.run(self.api.version_delete, name, version)
+
+    async def provider_create(
+        self, name, version, provider, checksum=None, checksum_type='sha256',
+        likely=None
+    ):
+        await self.run(
+            self.api.provider_create, name, version, provider, checksum,
+            checksum_type, likely
+        )
+
+    async def ensure_container(
+        self, name, version, provider, summary='', description='',
+        checksum=None
+    ):
+        await self.run(
+            self.api.ensure_container, name, version, provider, summary,
+            description, checksum
+        )
+
+    async def provider_upload(self, name, version, provider, file, progress=None):
+        await self.run(
+            self.api.provider_upload, name, version, provider, file, progress
+        )
+
+    async def provider_upload_chunked(
+        self, name, version, provider, file, chunk_size, progress=None
+    ):
+        await self.run(
+            self.api.provider_upload_chunked, name, version, provider, file,
+            chunk_size, progress
         )
-        print('')